@@ -1,27 +1,34 @@
 import streamlit as st
-import yt_dlp
 import os
-import tempfile
 import time
-import zipfile
-import io
-import re
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, APIC, error
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from artifact_store import ArtifactStore
+from audio_filters import filter_spec, format_timestamp
+from covers import normalize_cover, preview_thumbnail, preview_thumbnail_url
+from governor import default_governor
+from jobs import JobManager, TERMINAL_STATUSES, ITEM_TERMINAL_STATUSES, INTERRUPTED, batch_progress
+from metadata_cache import MetadataCache, cache_key, dedupe_urls, is_collection_url
+from metrics import default_metrics, serve_metrics
+from pipeline import cookie_file, make_info, resolve_metadata, sanitize_filename, warm_up
+from playlist_expander import PlaylistExpander, RUNNING as EXPANSION_RUNNING
+from tagging import read_tags, write_tagged_batch
+from transcode_cache import TranscodeCache
+from zip_stream import StreamingZipWriter
 
 # --- ページ設定 ---
 st.set_page_config(page_title="Audio Downloader Pro", layout="centered")
 
-# --- Font Awesome & カスタムCSSの注入 ---
+# --- カスタムCSSの注入 ---
+# 再実行のたびに送られるため、外部のCSS・フォントは読み込まない。
+# アイコンは Streamlit 同梱の Material Symbols を :material/名前: で使う
+# (ウィジェットのアイコンと同じフォントなので追加の読み込みも静的ファイルの配信も要らず、見た目も揃う)。
+# フォントは Streamlit の既定のまま
 st.markdown("""
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
     <style>
-        /* 全体のフォント設定 */
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;800&display=swap');
-        html, body, [class*="css"] {
-            font-family: 'Inter', sans-serif;
-        }
-
         /* メインタイトル */
         .main-title {
             font-size: 2.5rem;
@@ -67,61 +74,104 @@ st.markdown("""
         }
 
         /* アイコンのスタイル */
-        .icon-spacing {
-            margin-right: 10px;
+        [data-testid="stMarkdownContainer"] [data-testid="stIconMaterial"] {
+            margin-right: 6px;
             color: #0072ff;
         }
     </style>
 """, unsafe_allow_html=True)
 
 # --- ヘッダー部分 ---
-st.markdown('<div class="main-title"><i class="fa-solid fa-cloud-arrow-down icon-spacing"></i>Audio Downloader Pro</div>', unsafe_allow_html=True)
+st.markdown('<div class="main-title">Audio Downloader Pro</div>', unsafe_allow_html=True)
 st.markdown('<div class="sub-text">MP3一括ダウンロード・編集・メタデータ管理</div>', unsafe_allow_html=True)
 
-# ── 共通関数: ファイル名サニタイズ ──
-def sanitize_filename(name):
-    """ファイル名に使えない文字を除去"""
-    return re.sub(r'[\\/*?:"<>|]', "", name)
-
-# ── 共通関数: メタデータ書き込み (mutagen) ──
-def apply_id3_tags(file_path, title, artist, album, cover_data=None):
-    try:
-        audio = MP3(file_path, ID3=ID3)
-        try:
-            audio.add_tags()
-        except error:
-            pass
-
-        if title: audio.tags.add(TIT2(encoding=3, text=title))
-        if artist: audio.tags.add(TPE1(encoding=3, text=artist))
-        if album: audio.tags.add(TALB(encoding=3, text=album))
-
-        if cover_data:
-            audio.tags.add(
-                APIC(
-                    encoding=3, 
-                    mime='image/jpeg', 
-                    type=3, 
-                    desc='Cover',
-                    data=cover_data
-                )
+# ── 共通: アーティファクトストア・変換キャッシュ・ジョブ管理 (プロセス全体で共有) ──
+@st.cache_resource
+def get_artifact_store():
+    return ArtifactStore()
+
+@st.cache_resource
+def get_transcode_cache():
+    return TranscodeCache()
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager(get_artifact_store(), get_transcode_cache())
+
+# 段階ごとの処理時間をPrometheus形式で公開する (AUDIO_DL_METRICS_PORT を指定したときだけ)
+@st.cache_resource
+def get_metrics_server():
+    return serve_metrics() if settings.METRICS_PORT else None
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+artifact_store = get_artifact_store()
+job_manager = get_job_manager()
+get_metrics_server()
+artifact_store.touch_session(st.session_state.session_id)
+
+# ── 共通: 一覧の表示 (ページ分割・表での一括編集) ──
+# 再実行のたびに描画するウィジェットの数が、全件数ではなく1ページ分で済むようにする
+def shift_page(key, delta):
+    st.session_state[key] = st.session_state.get(key, 0) + delta
+
+def page_range(key, total, page_size=settings.PREVIEW_PAGE_SIZE):
+    """ページ送りを表示し、現在のページに表示する範囲 (start, end) を返す"""
+    page_count = max(1, -(-total // page_size))
+    page = max(0, min(st.session_state.get(key, 0), page_count - 1))
+    st.session_state[key] = page
+    if page_count > 1:
+        col_prev, col_pos, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("前へ", key=f"{key}_prev", on_click=shift_page, args=(key, -1), disabled=page == 0, use_container_width=True)
+        with col_pos:
+            st.markdown(
+                f'<div style="text-align:center;">{page * page_size + 1}〜{min((page + 1) * page_size, total)}件目 / {total}件'
+                f' (ページ {page + 1}/{page_count})</div>',
+                unsafe_allow_html=True
             )
-        audio.save()
-    except Exception as e:
-        print(f"Metadata Error: {e}")
+        with col_next:
+            st.button("次へ", key=f"{key}_next", on_click=shift_page, args=(key, 1), disabled=page == page_count - 1, use_container_width=True)
+    return page * page_size, min((page + 1) * page_size, total)
+
+def bulk_edit_table(items, columns, key):
+    """items の文字列項目を1つの表でまとめて編集する (columns は {項目名: 見出し})"""
+    rows = [{field: item[field] for field in columns} for item in items]
+    # 件数が変わったら (展開による追加など) 編集途中の行番号がずれないよう表を作り直す
+    edited = st.data_editor(
+        rows,
+        column_config={field: st.column_config.TextColumn(label) for field, label in columns.items()},
+        num_rows="fixed",
+        use_container_width=True,
+        key=f"{key}_{len(items)}"
+    )
+    for item, row in zip(items, edited):
+        for field in columns:
+            item[field] = row[field] or ''
+
+VIEW_MODES = ["カード", "表で一括編集"]
 
 # ── サイドバー設定 ──
 with st.sidebar:
-    st.markdown('### <i class="fa-solid fa-bars icon-spacing"></i> モード選択', unsafe_allow_html=True)
+    st.markdown('### :material/menu: モード選択')
     mode = st.radio("機能を選択", ["YouTubeダウンロード", "MP3タグ編集 (ローカル)"], label_visibility="collapsed")
     
     st.markdown('---')
-    st.markdown('### <i class="fa-solid fa-sliders icon-spacing"></i> 詳細設定', unsafe_allow_html=True)
+    st.markdown('### :material/tune: 詳細設定')
     
     if mode == "YouTubeダウンロード":
-        # 形式はMP3固定
-        format_type = 'mp3'
-        st.markdown('**<i class="fa-solid fa-headphones icon-spacing"></i> 音質設定**', unsafe_allow_html=True)
+        st.markdown('**:material/audio_file: 出力形式**')
+        # M4A・Opusは、元の音声が同じコーデックなら再エンコードせずに保存する (高速・劣化なし)
+        format_map = {
+            'MP3': 'mp3',
+            'M4A (AAC)': 'm4a',
+            'Opus': 'opus'
+        }
+        format_label = st.selectbox("形式", list(format_map.keys()), help="M4A・Opusは多くの場合、変換なしで保存できます")
+        format_type = format_map[format_label]
+
+        st.markdown('---')
+        st.markdown('**:material/headphones: 音質設定**')
         audio_quality_map = {
             '最高 (Best)': '0', 
             '高音質 (192kbps)': '192', 
@@ -130,448 +180,701 @@ with st.sidebar:
         quality_label = st.selectbox("ビットレート", list(audio_quality_map.keys()))
         quality_val = audio_quality_map[quality_label]
         
+        st.markdown('---')
+        st.markdown('**:material/graphic_eq: 音量・無音**')
+        # 加工はMP3等への変換と同じ1回のffmpeg実行で行う (加工する曲は変換なしの保存にはならない)
+        normalize = st.checkbox("音量を揃える (EBU R128)", value=False, help="曲ごとの音量の差をなくします")
+        loudness_map = {
+            '-14 LUFS (音楽配信)': -14.0,
+            '-16 LUFS (ポッドキャスト)': -16.0,
+            '-23 LUFS (放送)': -23.0
+        }
+        loudness_label = st.selectbox("目標ラウドネス", list(loudness_map.keys()), disabled=not normalize)
+        trim_silence = st.checkbox("前後の無音を削除", value=False)
+
         st.markdown('---')
         embed_thumb = st.checkbox("デフォルトサムネイル埋め込み", value=True)
 
+        st.markdown('---')
+        st.markdown('**:material/layers: 並列処理**')
+        max_workers = st.slider("同時ダウンロード数", min_value=1, max_value=8, value=3)
+
+    st.markdown('---')
+    show_diagnostics = st.checkbox("診断情報を表示", value=False, help="処理の段階ごとの所要時間 (プロセス全体の累計)")
+
 # ==========================================
 # モードA: YouTubeダウンローダー
 # ==========================================
 if mode == "YouTubeダウンロード":
 
-    # ── 内部関数: Cookieの自動生成 ──
-    def create_cookie_file(tmp_dir):
+    # ── 内部関数: Cookieの取得 (secretsから) ──
+    def get_cookie_content():
         if "general" in st.secrets and "YOUTUBE_COOKIES" in st.secrets["general"]:
-            cookie_content = st.secrets["general"]["YOUTUBE_COOKIES"]
-            if cookie_content.strip(): # 空でない場合のみ作成
-                cookie_path = os.path.join(tmp_dir, "cookies.txt")
-                with open(cookie_path, "w", encoding="utf-8") as f:
-                    f.write(cookie_content)
-                return cookie_path
+            return st.secrets["general"]["YOUTUBE_COOKIES"]
         return None
 
+    # ── 内部関数: メタデータキャッシュ (プロセス全体で共有) ──
+    @st.cache_resource
+    def get_metadata_cache():
+        return MetadataCache()
+
+    # ── 内部関数: プレイリスト・チャンネルの展開 (プロセス全体で共有) ──
+    @st.cache_resource
+    def get_playlist_expander():
+        return PlaylistExpander()
+
+    playlist_expander = get_playlist_expander()
+
+    # ── 内部関数: 起動時の事前準備 (プロセスで1回) ──
+    # 最初のリクエストの前に、yt-dlpの読み込み・抽出器の初期化とffmpegの確認をバックグラウンドで済ませる
+    # (画面の表示は待たせない。AUDIO_DL_WARMUP=0 で無効)
+    @st.cache_resource
+    def get_warmup():
+        if not settings.WARMUP:
+            return None
+        # 解析と同じCookieで準備すると、最初の解析が準備済みのインスタンスを使える
+        # (secretsの初回の読み込みも数百msかかるため、ここで済ませておく)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup")
+        future = executor.submit(lambda: warm_up(cookie_file(get_cookie_content())))
+        executor.shutdown(wait=False)
+        return future
+
+    warmup = get_warmup()
+    if warmup is not None and warmup.done() and warmup.exception() is None and warmup.result() is None:
+        st.warning("ffmpegが見つかりません。音声の変換ができないため、ダウンロードは失敗します。")
+
     # ── 内部関数: 動画削除コールバック ──
     def remove_video(index):
         if 0 <= index < len(st.session_state.video_infos):
             del st.session_state.video_infos[index]
 
-    # ── 進捗表示用のクラス ──
-    class ProgressHooks:
-        def __init__(self, status_placeholder, progress_bar):
-            self.status_placeholder = status_placeholder
-            self.progress_bar = progress_bar
-
-        def hook(self, d):
-            if d['status'] == 'downloading':
-                p = d.get('_percent_str', '0%').replace('%','')
-                try:
-                    per = float(p)
-                except:
-                    per = 0
-                
-                self.progress_bar.progress(min(per / 100, 1.0))
-                speed = d.get('_speed_str', 'N/A')
-                self.status_placeholder.markdown(f'<i class="fa-solid fa-spinner fa-spin"></i> ダウンロード中... {d["_percent_str"]} (速度: {speed})', unsafe_allow_html=True)
-                
-            elif d['status'] == 'finished':
-                self.progress_bar.progress(1.0)
-                self.status_placeholder.markdown('<i class="fa-solid fa-arrows-rotate fa-spin"></i> 変換処理中...', unsafe_allow_html=True)
-
     # ── 処理ロジック ──
     def get_video_info(urls):
         info_list = []
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            cookie_path = create_cookie_file(tmp_dir)
-            
-            # 【修正点】オプションを強化してエラーを回避
-            ydl_opts = {
-                'quiet': True,
-                'extract_flat': False,
-                'skip_download': True,
-                'format': 'best',        # 形式を指定して検索を安定化
-                'noplaylist': True,      # プレイリストURLでも単体動画として処理
-                'check_formats': False,  # メタデータ取得時は厳密なフォーマットチェックをスキップ
-                'ignoreerrors': True,    # エラーでも停止しない
-            }
-            if cookie_path: ydl_opts['cookiefile'] = cookie_path
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                for url in urls:
-                    try:
-                        # download=Falseで情報のみ取得
-                        info = ydl.extract_info(url, download=False)
-                        
-                        if not info:
-                            st.error(f"情報の取得に失敗しました: {url}")
-                            continue
-
-                        info_list.append({
-                            'title': info.get('title', 'Unknown'),
-                            'uploader': info.get('uploader', 'Unknown'),
-                            'thumbnail': info.get('thumbnail'),
-                            'duration': info.get('duration'),
-                            'url': url,
-                            'custom_filename': sanitize_filename(info.get('title', 'audio')), 
-                            'custom_title': info.get('title', 'Unknown'),
-                            'custom_artist': info.get('uploader', 'Unknown'),
-                            'custom_album': '', 
-                            'custom_cover_bytes': None
-                        })
-                    except Exception as e:
-                        st.error(f"Error ({url}): {e}")
+        cookie_path = cookie_file(get_cookie_content())
+        resolved = resolve_metadata(urls, cookie_path, get_metadata_cache())
+
+        # 結果は入力順に並べる
+        for url, (meta, error) in zip(urls, resolved):
+            if error:
+                st.error(f"Error ({url}): {error}")
+            elif not meta:
+                st.error(f"情報の取得に失敗しました: {url}")
+            else:
+                info_list.append(make_info(url, meta))
         return info_list
 
-    def process_download(info_list):
-        downloaded_data = []
-        zip_buffer = None
-        main_progress = st.progress(0)
-        main_status = st.empty()
-        total_videos = len(info_list)
-
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            cookie_path = create_cookie_file(tmp_dir)
-            for idx, info in enumerate(info_list):
-                url = info['url']
-                final_filename = sanitize_filename(info['custom_filename'])
-                final_title = info.get('custom_title', '')
-                final_artist = info.get('custom_artist', '')
-                final_album = info.get('custom_album', '')
-                custom_cover = info.get('custom_cover_bytes')
-
-                main_status.markdown(f'<i class="fa-solid fa-list-check icon-spacing"></i> 処理中 ({idx+1}/{total_videos}): **{final_filename}**', unsafe_allow_html=True)
-                
-                single_status = st.empty()
-                single_bar = st.progress(0)
-                hooks = ProgressHooks(single_status, single_bar)
-
-                ydl_opts = {
-                    'outtmpl': f'{tmp_dir}/{final_filename}.%(ext)s',
-                    'quiet': True,
-                    'progress_hooks': [hooks.hook],
-                    'format': 'bestaudio/best', # 音質優先で選択
-                    'noplaylist': True,
-                }
-                if cookie_path: ydl_opts['cookiefile'] = cookie_path
+    # ── 展開したエントリをプレビューへ追加 (既にリストにある動画は追加しない) ──
+    def add_expanded_entries(entries):
+        known = {cache_key(info['url']) for info in st.session_state.video_infos}
+        added = 0
+        for url, meta in entries:
+            key = cache_key(url)
+            if key in known:
+                continue
+            known.add(key)
+            st.session_state.video_infos.append(make_info(url, meta))
+            added += 1
+        return added
+
+    def stop_expansion():
+        if st.session_state.get('expansion_id'):
+            playlist_expander.discard(st.session_state.expansion_id)
+        st.session_state.expansion_id = None
+
+    # ── 展開状況: 新しいページが届いたら画面全体を再実行してプレビューに反映 ──
+    @st.fragment(run_every=1.0)
+    def playlist_expansion_panel(expansion_id):
+        snapshot = playlist_expander.get(expansion_id, st.session_state.expansion_cursor)
+        if snapshot is None:
+            st.session_state.expansion_id = None
+            st.rerun()
 
-                postprocessors = [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3'}]
-                if quality_val != '0':
-                    postprocessors[0]['preferredquality'] = quality_val
-                
-                postprocessors.append({'key': 'FFmpegMetadata', 'add_metadata': True})
-                
-                if embed_thumb and not custom_cover:
-                    ydl_opts['writethumbnail'] = True
-                    postprocessors.append({'key': 'EmbedThumbnail'})
-                
-                ydl_opts.update({'postprocessors': postprocessors})
+        st.session_state.expansion_cursor = snapshot['total']
+        added = add_expanded_entries(snapshot['entries'])
+        if snapshot['status'] != EXPANSION_RUNNING:
+            st.session_state.expansion_errors = snapshot['errors']
+            stop_expansion()
+            st.rerun()
+        if added:
+            st.rerun()
 
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([url])
-                    
-                    mp3_path = os.path.join(tmp_dir, f"{final_filename}.mp3")
-                    if os.path.exists(mp3_path):
-                        apply_id3_tags(mp3_path, title=final_title, artist=final_artist, album=final_album, cover_data=custom_cover)
+        col_msg, col_cancel = st.columns([3, 1])
+        with col_msg:
+            st.markdown(f':material/progress_activity: プレイリストを展開中... ({snapshot["total"]}件取得)')
+        with col_cancel:
+            if st.button("展開を中止", key="cancel_expansion", use_container_width=True):
+                playlist_expander.cancel(expansion_id)
+
+    # ── 進捗表示: ジョブの状態をポーリングして描画 (この部分だけ定期的に再実行) ──
+    ITEM_STATUS_LABELS = {'queued': "待機中", 'downloading': "ダウンロード中", 'converting': "変換中", 'done': "完了", 'error': "エラー"}
+    STAGE_LABELS = {'transcoding': "音声を変換中", 'tagging': "タグを書き込み中"}
+
+    def format_bytes(size):
+        for unit in ("B", "KB", "MB"):
+            if size < 1024:
+                return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} GB"
+
+    def format_duration(seconds):
+        minutes, seconds = divmod(int(seconds), 60)
+        return f"{minutes}分{seconds:02d}秒" if minutes else f"{seconds}秒"
+
+    def item_detail(item):
+        detail = item['detail']
+        if item['status'] == 'downloading':
+            if detail.get('retry'):
+                return detail['retry']
+            done = format_bytes(detail.get('downloaded_bytes') or 0)
+            total = format_bytes(detail['total_bytes']) if detail.get('total_bytes') else "?"
+            speed = f" ({format_bytes(detail['speed'])}/s)" if detail.get('speed') else ""
+            return f"{done} / {total}{speed}"
+        if item['status'] == 'converting':
+            return STAGE_LABELS.get(detail.get('stage'), "")
+        if item['status'] == 'error':
+            return detail.get('error', '')
+        if item['status'] == 'queued' and detail.get('position') is not None:
+            return f"順番待ち (前に{detail['position']}件)"
+        return ""
+
+    @st.fragment(run_every=1.0)
+    def job_progress_panel(job_id):
+        job = job_manager.get(job_id)
+        if job is None or job['status'] in TERMINAL_STATUSES:
+            # 完了したら画面全体を再実行して完了画面へ
+            st.rerun()
 
-                    single_status.markdown('<i class="fa-solid fa-circle-check" style="color:#00ff88"></i> 完了', unsafe_allow_html=True)
-                except Exception as e:
-                    single_status.error(f"エラー: {e}")
-                    # ダウンロードエラーでも続行する場合はcontinue
-                    continue
-                
-                main_progress.progress((idx + 1) / total_videos)
-
-            files = [f for f in os.listdir(tmp_dir) if f.endswith(".mp3")]
-            for filename in files:
-                with open(os.path.join(tmp_dir, filename), "rb") as f:
-                    downloaded_data.append({"filename": filename, "data": f.read(), "mime": "audio/mpeg"})
-
-            if len(files) > 0:
-                zip_io = io.BytesIO()
-                with zipfile.ZipFile(zip_io, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    for filename in files:
-                        zf.write(os.path.join(tmp_dir, filename), arcname=filename)
-                zip_buffer = zip_io.getvalue()
-                
-            main_status.markdown('<i class="fa-solid fa-face-smile icon-spacing"></i> すべての処理が完了しました！', unsafe_allow_html=True)
-            return downloaded_data, zip_buffer
+        # 全体の進捗・速度・残り時間は1か所にまとめ、アイテムごとの状態は1つの表で表示する
+        items = job['items']
+        progress = batch_progress(items)
+        st.progress(progress['fraction'])
+        summary = f"処理中 ({progress['finished']}/{progress['total']})"
+        if progress['speed']:
+            summary += f" · {format_bytes(progress['speed'])}/s"
+        if progress['eta'] is not None:
+            summary += f" · 残り約{format_duration(progress['eta'])}"
+        if progress['queue_position'] is not None and not progress['running']:
+            # 他のセッションの処理で実行枠が埋まっている
+            summary += f" · 順番待ち (前に{progress['queue_position']}件)"
+        st.markdown(f':material/checklist: {summary}')
+
+        st.dataframe(
+            [
+                {
+                    "状態": ITEM_STATUS_LABELS.get(item['status'], item['status']),
+                    "ファイル名": item['filename'],
+                    "進捗": 1.0 if item['status'] in ITEM_TERMINAL_STATUSES else item['fraction'],
+                    "詳細": item_detail(item),
+                }
+                for item in items
+            ],
+            column_config={"進捗": st.column_config.ProgressColumn("進捗", min_value=0.0, max_value=1.0, format="percent")},
+            hide_index=True,
+            use_container_width=True,
+        )
 
     # --- メインUI (Downloader) ---
     if 'stage' not in st.session_state:
         st.session_state.stage = 'input'
     if 'video_infos' not in st.session_state:
         st.session_state.video_infos = []
+    if 'expansion_id' not in st.session_state:
+        st.session_state.expansion_id = None
+        st.session_state.expansion_cursor = 0
+        st.session_state.expansion_errors = []
+    if 'input_duplicates' not in st.session_state:
+        st.session_state.input_duplicates = []
+
+    # 再接続時: URLに残したジョブIDから処理中/完了画面を復元する
+    job_param = st.query_params.get('job')
+    if job_param and st.session_state.get('job_id') != job_param:
+        st.session_state.job_id = job_param
+        st.session_state.stage = 'processing'
 
     # ステップ1: URL入力
     if st.session_state.stage == 'input':
-        st.markdown('### <i class="fa-solid fa-link icon-spacing"></i> 1. URLを入力', unsafe_allow_html=True)
+        st.markdown('### :material/link: 1. URLを入力')
         url_input = st.text_area(
             label="URL入力",
             placeholder="https://www.youtube.com/watch?v=...\nhttps://youtu.be/...",
             height=150,
             label_visibility="collapsed"
         )
+        expand_playlists = st.checkbox(
+            "プレイリスト・チャンネルを展開する",
+            help="プレイリストやチャンネルのURLを、含まれる動画の一覧として追加します (取得できた分から順に表示)"
+        )
 
         if st.button("情報を解析する", type="primary", use_container_width=True):
             urls = [u.strip() for u in url_input.splitlines() if u.strip()]
             if urls:
-                with st.spinner("情報を取得しています..."):
-                    infos = get_video_info(urls)
-                    if infos:
-                        st.session_state.video_infos = infos
-                        st.session_state.stage = 'preview'
-                        st.rerun()
-                    else:
-                        st.warning("情報の取得に失敗しました。URLを確認するか、しばらく待ってから試してください。")
+                collection_urls = [u for u in urls if expand_playlists and is_collection_url(u)]
+                # 同じ動画の別表記 (youtu.be / m.youtube.com / 再生位置付き等) は1つにまとめ、解析・ダウンロードを1回にする
+                video_urls, duplicates = dedupe_urls([u for u in urls if u not in collection_urls])
+                infos = []
+                if video_urls:
+                    with st.spinner("情報を取得しています..."):
+                        infos = get_video_info(video_urls)
+                if infos or collection_urls:
+                    stop_expansion()
+                    st.session_state.video_infos = infos
+                    st.session_state.expansion_errors = []
+                    st.session_state.input_duplicates = duplicates
+                    if collection_urls:
+                        # 一覧はバックグラウンドで展開し、取得できたページから順にプレビューへ追加する
+                        st.session_state.expansion_id = playlist_expander.submit(collection_urls, get_cookie_content())
+                        st.session_state.expansion_cursor = 0
+                    st.session_state.stage = 'preview'
+                    st.rerun()
+                else:
+                    st.warning("情報の取得に失敗しました。URLを確認するか、しばらく待ってから試してください。")
             else:
                 st.warning("URLを入力してください")
 
     # ステップ2: プレビュー & 編集
     if st.session_state.stage == 'preview':
-        st.markdown(f'### <i class="fa-solid fa-pen-to-square icon-spacing"></i> 2. 編集と確認 ({len(st.session_state.video_infos)}件)', unsafe_allow_html=True)
+        st.markdown(f'### :material/edit_square: 2. 編集と確認 ({len(st.session_state.video_infos)}件)')
+
+        if st.session_state.expansion_id:
+            playlist_expansion_panel(st.session_state.expansion_id)
+        for error in st.session_state.expansion_errors:
+            st.error(f"展開エラー ({error})")
+        if st.session_state.input_duplicates:
+            with st.expander(f"重複していたURLを{len(st.session_state.input_duplicates)}件除外しました"):
+                for url, first_url in st.session_state.input_duplicates:
+                    st.caption(f"{url} (→ {first_url} と同じ動画)")
         
-        if len(st.session_state.video_infos) == 0:
+        if len(st.session_state.video_infos) == 0 and not st.session_state.expansion_id:
             st.info("リストが空です。URLを入力し直してください。")
             if st.button("戻る"):
                 st.session_state.stage = 'input'
                 st.rerun()
         
-        current_infos = st.session_state.video_infos.copy()
-        
-        for idx, info in enumerate(current_infos):
-            with st.container():
-                st.markdown('<div class="edit-card">', unsafe_allow_html=True)
+        view_mode = st.radio("表示形式", VIEW_MODES, horizontal=True, key="preview_view")
+        if view_mode == "表で一括編集":
+            st.caption("カバー画像の変更とリストからの削除はカード表示で行えます")
+            bulk_edit_table(
+                st.session_state.video_infos,
+                {'custom_filename': "ファイル名 (拡張子なし)", 'custom_title': "タイトル", 'custom_artist': "アーティスト", 'custom_album': "アルバム名",
+                 'custom_start': "開始 (m:ss)", 'custom_end': "終了 (m:ss)"},
+                key="preview_table"
+            )
+        else:
+            start, end = page_range("preview_page", len(st.session_state.video_infos))
+            for idx in range(start, end):
+                info = st.session_state.video_infos[idx]
+                with st.container():
+                    st.markdown('<div class="edit-card">', unsafe_allow_html=True)
                 
-                # レイアウト用のカラムを作成（左：画像、中：編集、右：削除）
-                col_img, col_edit, col_del = st.columns([1.5, 3, 0.5])
+                    # レイアウト用のカラムを作成（左：画像、中：編集、右：削除）
+                    col_img, col_edit, col_del = st.columns([1.5, 3, 0.5])
                 
-                with col_edit:
-                    new_filename = st.text_input("ファイル名 (拡張子なし)", value=info['custom_filename'], key=f"fname_{idx}")
-                    c_title, c_artist = st.columns(2)
-                    with c_title:
-                        new_title = st.text_input("タイトル", value=info['custom_title'], key=f"title_{idx}")
-                    with c_artist:
-                        new_artist = st.text_input("アーティスト", value=info['custom_artist'], key=f"artist_{idx}")
-                    new_album = st.text_input("アルバム名", value=info['custom_album'], key=f"album_{idx}")
+                    with col_edit:
+                        new_filename = st.text_input("ファイル名 (拡張子なし)", value=info['custom_filename'], key=f"fname_{idx}")
+                        c_title, c_artist = st.columns(2)
+                        with c_title:
+                            new_title = st.text_input("タイトル", value=info['custom_title'], key=f"title_{idx}")
+                        with c_artist:
+                            new_artist = st.text_input("アーティスト", value=info['custom_artist'], key=f"artist_{idx}")
+                        new_album = st.text_input("アルバム名", value=info['custom_album'], key=f"album_{idx}")
                     
-                    # 画像アップローダー
-                    uploaded_cover = st.file_uploader("カバー画像を変更 (jpg/png)", type=['jpg', 'jpeg', 'png'], key=f"cover_{idx}")
+                        # 画像アップローダー
+                        uploaded_cover = st.file_uploader("カバー画像を変更 (jpg/png)", type=['jpg', 'jpeg', 'png'], key=f"cover_{idx}")
                     
-                    # セッションステート更新
-                    st.session_state.video_infos[idx]['custom_filename'] = new_filename
-                    st.session_state.video_infos[idx]['custom_title'] = new_title
-                    st.session_state.video_infos[idx]['custom_artist'] = new_artist
-                    st.session_state.video_infos[idx]['custom_album'] = new_album
+                        # セッションステート更新
+                        st.session_state.video_infos[idx]['custom_filename'] = new_filename
+                        st.session_state.video_infos[idx]['custom_title'] = new_title
+                        st.session_state.video_infos[idx]['custom_artist'] = new_artist
+                        st.session_state.video_infos[idx]['custom_album'] = new_album
                     
-                    if uploaded_cover is not None:
-                        st.session_state.video_infos[idx]['custom_cover_bytes'] = uploaded_cover.getvalue()
-
-                with col_img:
-                    current_cover = st.session_state.video_infos[idx].get('custom_cover_bytes')
-                    default_thumb = info.get('thumbnail')
+                        if uploaded_cover is not None:
+                            try:
+                                st.session_state.video_infos[idx]['custom_cover_bytes'] = normalize_cover(uploaded_cover.getvalue())
+                            except ValueError as e:
+                                st.error(str(e))
+
+                    with col_img:
+                        current_cover = st.session_state.video_infos[idx].get('custom_cover_bytes')
+                        default_thumb = preview_thumbnail_url(info['url'], info.get('thumbnail'))
                     
-                    display_thumb = current_cover if current_cover else default_thumb
+                        display_thumb = preview_thumbnail(current_cover) if current_cover else default_thumb
                     
-                    if display_thumb:
-                        st.image(display_thumb, use_container_width=True)
-                    else:
-                        st.markdown('<div style="height:100px; background:#333; display:flex; align-items:center; justify-content:center; color:#666;">No Image</div>', unsafe_allow_html=True)
+                        if display_thumb:
+                            st.image(display_thumb, use_container_width=True)
+                        else:
+                            st.markdown('<div style="height:100px; background:#333; display:flex; align-items:center; justify-content:center; color:#666;">No Image</div>', unsafe_allow_html=True)
                     
-                    duration_m = info['duration'] // 60 if info['duration'] else 0
-                    duration_s = info['duration'] % 60 if info['duration'] else 0
-                    st.caption(f"長さ: {duration_m}:{duration_s:02d}")
-
-                with col_del:
-                    st.markdown("<br>", unsafe_allow_html=True)
-                    if st.button("削除", key=f"del_{idx}", help="リストから削除", type="secondary"):
-                        remove_video(idx)
-                        st.rerun()
+                        duration_m = info['duration'] // 60 if info['duration'] else 0
+                        duration_s = info['duration'] % 60 if info['duration'] else 0
+                        st.caption(f"長さ: {duration_m}:{duration_s:02d}")
+
+                        # 切り出す範囲 (空欄なら先頭から・最後まで)
+                        c_start, c_end = st.columns(2)
+                        with c_start:
+                            new_start = st.text_input("開始", value=info.get('custom_start', ''), placeholder="0:00", key=f"start_{idx}")
+                        with c_end:
+                            new_end = st.text_input("終了", value=info.get('custom_end', ''), placeholder=f"{duration_m}:{duration_s:02d}", key=f"end_{idx}")
+                        st.session_state.video_infos[idx]['custom_start'] = new_start
+                        st.session_state.video_infos[idx]['custom_end'] = new_end
+                        try:
+                            clip = filter_spec({'custom_start': new_start, 'custom_end': new_end}, {}) or {}
+                        except ValueError as e:
+                            st.error(str(e))
+                        else:
+                            clip_end = clip.get('end', info['duration'])
+                            if clip and clip_end:
+                                st.caption(f"切り出し後: {format_timestamp(max(clip_end - clip.get('start', 0), 0))}")
+
+                    with col_del:
+                        st.markdown("<br>", unsafe_allow_html=True)
+                        if st.button("削除", key=f"del_{idx}", help="リストから削除", type="secondary"):
+                            remove_video(idx)
+                            st.rerun()
                         
-                st.markdown('</div>', unsafe_allow_html=True)
+                    st.markdown('</div>', unsafe_allow_html=True)
         
         st.markdown("---")
+        options = {'quality': quality_val, 'embed_thumb': embed_thumb, 'max_workers': max_workers, 'format': format_type,
+                   'normalize': normalize, 'loudness': loudness_map[loudness_label], 'trim_silence': trim_silence}
+        # 切り出す範囲が正しくないアイテムがあれば、ジョブの途中で失敗させずに開始前に止める
+        # (表の編集や別のページのカードの分もここでまとめて確認する)
+        invalid_items = []
+        for idx, info in enumerate(st.session_state.video_infos):
+            try:
+                filter_spec(info, options)
+            except ValueError as e:
+                invalid_items.append(f"{idx + 1}. {info['custom_filename']}: {e}")
+        if invalid_items:
+            st.error("切り出す範囲が正しくないアイテムがあります。修正するとダウンロードを開始できます。\n\n"
+                     + "\n".join(f"- {item}" for item in invalid_items))
         c1, c2 = st.columns(2)
         with c1:
             if st.button("URL入力に戻る", use_container_width=True):
+                stop_expansion()
                 st.session_state.stage = 'input'
                 st.rerun()
         with c2:
-            if st.button("ダウンロード開始", type="primary", use_container_width=True):
+            if st.button("ダウンロード開始", type="primary", use_container_width=True, disabled=bool(invalid_items)):
+                # 処理はバックグラウンドのジョブとして実行し、画面は進捗をポーリングするだけにする
+                # (展開中の一覧は、その時点までに取得できた分だけを対象にする)
+                stop_expansion()
+                job_id = job_manager.submit(
+                    st.session_state.session_id,
+                    [dict(info) for info in st.session_state.video_infos],
+                    options,
+                    get_cookie_content()
+                )
+                st.session_state.job_id = job_id
+                st.query_params['job'] = job_id
                 st.session_state.stage = 'processing'
                 st.rerun()
 
     # ステップ3: ダウンロード処理
     if st.session_state.stage == 'processing':
-        results, zip_data = process_download(st.session_state.video_infos)
-        if results:
-            st.session_state.download_results = results
-            st.session_state.zip_data = zip_data
+        job = job_manager.get(st.session_state.job_id)
+        if job is not None and job['status'] not in TERMINAL_STATUSES:
+            job_progress_panel(st.session_state.job_id)
+        elif job is not None and job['results']:
+            # 再接続したセッションでも成果物を保持できるよう、このセッションの参照を追加する
+            for digest in [job['zip_artifact']] + [item['artifact'] for item in job['results']]:
+                artifact_store.add_ref(st.session_state.session_id, digest)
+            st.session_state.download_results = job['results']
+            st.session_state.zip_artifact = job['zip_artifact']
             st.session_state.stage = 'finished'
             st.rerun()
         else:
-            st.error("ダウンロード可能なファイルがありませんでした。")
+            if job is None:
+                st.error("ジョブが見つかりませんでした。")
+            else:
+                for item in job['items']:
+                    if item['status'] == 'error':
+                        st.error(f"エラー ({item['filename']}): {item['detail'].get('error', '')}")
+                if job['status'] == INTERRUPTED:
+                    st.error("サーバーの再起動により処理が中断されました。")
+                st.error("ダウンロード可能なファイルがありませんでした。")
             if st.button("戻る"):
+                st.query_params.pop('job', None)
+                st.session_state.job_id = None
                 st.session_state.stage = 'preview'
                 st.rerun()
 
     # ステップ4: 完了画面
     if st.session_state.stage == 'finished':
-        st.markdown('### <i class="fa-solid fa-download icon-spacing"></i> 3. ダウンロード', unsafe_allow_html=True)
-        if st.session_state.zip_data:
-            st.download_button("ZIPでまとめて保存", st.session_state.zip_data, "audio_archive.zip", "application/zip", type="primary", use_container_width=True)
+        st.markdown('### :material/download: 3. ダウンロード')
+        if st.session_state.zip_artifact and artifact_store.path(st.session_state.zip_artifact):
+            st.download_button("ZIPでまとめて保存", artifact_store.reader(st.session_state.zip_artifact), "audio_archive.zip", "application/zip", type="primary", use_container_width=True)
 
         st.markdown("#### 個別ファイル")
         for item in st.session_state.download_results:
             col_dl_1, col_dl_2 = st.columns([3, 1])
             with col_dl_1:
-                st.markdown(f'<i class="fa-solid fa-file-audio icon-spacing"></i>**{item["filename"]}**', unsafe_allow_html=True)
+                st.markdown(f':material/audio_file: **{item["filename"]}**')
             with col_dl_2:
-                st.download_button("保存", item['data'], item['filename'], item['mime'], key=f"dl_{item['filename']}", use_container_width=True)
+                if artifact_store.path(item['artifact']):
+                    st.download_button("保存", artifact_store.reader(item['artifact']), item['filename'], item['mime'], key=f"dl_{item['filename']}", use_container_width=True)
+                else:
+                    st.caption("保存期限切れ")
             st.markdown("<hr style='margin: 5px 0; opacity: 0.2;'>", unsafe_allow_html=True)
             
         if st.button("最初に戻る"):
+            artifact_store.release(
+                st.session_state.session_id,
+                [st.session_state.zip_artifact] + [item['artifact'] for item in st.session_state.download_results]
+            )
+            st.query_params.pop('job', None)
+            st.session_state.job_id = None
             st.session_state.stage = 'input'
             st.session_state.video_infos = []
             st.session_state.download_results = None
+            st.session_state.zip_artifact = None
             st.rerun()
 
 # ==========================================
 # モードB: MP3タグ編集 (ローカル)
 # ==========================================
 elif mode == "MP3タグ編集 (ローカル)":
-    st.markdown('### <i class="fa-solid fa-file-audio icon-spacing"></i> MP3ファイルをアップロード', unsafe_allow_html=True)
+    st.markdown('### :material/audio_file: MP3ファイルをアップロード')
     
     # セッション管理
     if 'editor_files' not in st.session_state:
         st.session_state.editor_files = []
     if 'editor_processed_zip' not in st.session_state:
         st.session_state.editor_processed_zip = None
+    if 'editor_seen_uploads' not in st.session_state:
+        st.session_state.editor_seen_uploads = set()
+    if 'editor_tag_index' not in st.session_state:
+        st.session_state.editor_tag_index = {}
+    if 'editor_duplicates' not in st.session_state:
+        st.session_state.editor_duplicates = []
 
     uploaded_files = st.file_uploader("MP3ファイルを選択（複数可）", type=['mp3'], accept_multiple_files=True)
     
     # ファイルがアップロードされたら解析してセッションに格納
+    # (処理済みのアップロードはfile_idで、解析結果は内容のハッシュで索引し、再実行時は読み直さない)
     if uploaded_files:
-        current_filenames = [f['original_name'] for f in st.session_state.editor_files]
-        
-        new_files_added = False
-        for up_file in uploaded_files:
-            if up_file.name not in current_filenames:
+        seen_uploads = st.session_state.editor_seen_uploads
+        new_uploads = [f for f in uploaded_files if f.file_id not in seen_uploads]
+
+        if new_uploads:
+            session_id = st.session_state.session_id
+            tag_index = st.session_state.editor_tag_index
+
+            # 内容が同じファイル (名前を変えたコピー等) は1つだけ追加し、解析・保存もしない
+            known = {item['artifact']: item['original_name'] for item in st.session_state.editor_files}
+            unique_uploads = []
+            for up_file in new_uploads:
+                seen_uploads.add(up_file.file_id)
+                digest = hashlib.sha256(up_file.getbuffer()).hexdigest()
+                if digest in known:
+                    if (up_file.name, known[digest]) not in st.session_state.editor_duplicates:
+                        st.session_state.editor_duplicates.append((up_file.name, known[digest]))
+                    continue
+                known[digest] = up_file.name
+                unique_uploads.append((up_file, digest))
+
+            def ingest_upload(up_file, digest):
+                parsed = tag_index.get(digest)
+                if parsed is None:
+                    parsed = read_tags(up_file)
+                up_file.seek(0)
+                artifact_store.put_stream(session_id, up_file, digest)
+                return parsed
+
+            with ThreadPoolExecutor(max_workers=settings.METADATA_WORKERS) as executor:
+                futures = [executor.submit(ingest_upload, up_file, digest) for up_file, digest in unique_uploads]
+
+            for (up_file, digest), future in zip(unique_uploads, futures):
                 try:
-                    # 一時ファイルに保存してmutagenで解析
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                        tmp.write(up_file.getvalue())
-                        tmp_path = tmp.name
-                    
-                    audio = MP3(tmp_path, ID3=ID3)
-                    
-                    title = str(audio.tags.get("TIT2", "")) if "TIT2" in audio.tags else ""
-                    artist = str(audio.tags.get("TPE1", "")) if "TPE1" in audio.tags else ""
-                    album = str(audio.tags.get("TALB", "")) if "TALB" in audio.tags else ""
-                    
-                    cover_bytes = None
-                    for tag in audio.tags.values():
-                        if isinstance(tag, APIC):
-                            cover_bytes = tag.data
-                            break
-                    
-                    st.session_state.editor_files.append({
-                        'original_name': up_file.name,
-                        'file_data': up_file.getvalue(), 
-                        'filename': os.path.splitext(up_file.name)[0],
-                        'title': title,
-                        'artist': artist,
-                        'album': album,
-                        'cover_bytes': cover_bytes,
-                        'new_cover_bytes': None
-                    })
-                    new_files_added = True
-                    os.unlink(tmp_path)
+                    parsed = future.result()
                 except Exception as e:
                     st.error(f"ファイル {up_file.name} の解析エラー: {e}")
+                    continue
+                tag_index[digest] = parsed
+                st.session_state.editor_files.append({
+                    'original_name': up_file.name,
+                    'artifact': digest, 
+                    'filename': os.path.splitext(up_file.name)[0],
+                    'title': parsed['title'],
+                    'artist': parsed['artist'],
+                    'album': parsed['album'],
+                    'cover_bytes': parsed['cover_bytes'],
+                    'new_cover_bytes': None
+                })
 
     # 編集画面
     if st.session_state.editor_files:
         st.markdown(f"### 編集 ({len(st.session_state.editor_files)}件)")
+        if st.session_state.editor_duplicates:
+            with st.expander(f"同じ内容のファイルを{len(st.session_state.editor_duplicates)}件除外しました"):
+                for name, first_name in st.session_state.editor_duplicates:
+                    st.caption(f"{name} (→ {first_name} と同じ内容)")
         
         if st.button("すべてクリア", type="secondary"):
+            artifact_store.release(
+                st.session_state.session_id,
+                [st.session_state.editor_processed_zip] + [item['artifact'] for item in st.session_state.editor_files]
+            )
             st.session_state.editor_files = []
+            st.session_state.editor_tag_index = {}
+            st.session_state.editor_duplicates = []
+            st.session_state.editor_processed_zip = None
             st.rerun()
 
-        edit_list = st.session_state.editor_files
-        for idx, item in enumerate(edit_list):
-            st.markdown('<div class="edit-card">', unsafe_allow_html=True)
-            col_img, col_info, col_del = st.columns([1.5, 3, 0.5])
+        view_mode = st.radio("表示形式", VIEW_MODES, horizontal=True, key="editor_view")
+        if view_mode == "表で一括編集":
+            st.caption("カバー画像の変更とファイルの削除はカード表示で行えます")
+            bulk_edit_table(
+                st.session_state.editor_files,
+                {'filename': "ファイル名", 'title': "タイトル", 'artist': "アーティスト", 'album': "アルバム"},
+                key="editor_table"
+            )
+        else:
+            start, end = page_range("editor_page", len(st.session_state.editor_files))
+            for idx in range(start, end):
+                item = st.session_state.editor_files[idx]
+                st.markdown('<div class="edit-card">', unsafe_allow_html=True)
+                col_img, col_info, col_del = st.columns([1.5, 3, 0.5])
             
-            with col_info:
-                new_fname = st.text_input("ファイル名", value=item['filename'], key=f"ed_fn_{idx}")
-                c1, c2 = st.columns(2)
-                with c1:
-                    new_title = st.text_input("タイトル", value=item['title'], key=f"ed_ti_{idx}")
-                with c2:
-                    new_artist = st.text_input("アーティスト", value=item['artist'], key=f"ed_ar_{idx}")
-                new_album = st.text_input("アルバム", value=item['album'], key=f"ed_al_{idx}")
+                with col_info:
+                    new_fname = st.text_input("ファイル名", value=item['filename'], key=f"ed_fn_{idx}")
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        new_title = st.text_input("タイトル", value=item['title'], key=f"ed_ti_{idx}")
+                    with c2:
+                        new_artist = st.text_input("アーティスト", value=item['artist'], key=f"ed_ar_{idx}")
+                    new_album = st.text_input("アルバム", value=item['album'], key=f"ed_al_{idx}")
                 
-                up_cover = st.file_uploader("画像変更", type=['jpg','png'], key=f"ed_cv_{idx}")
-                if up_cover:
-                    st.session_state.editor_files[idx]['new_cover_bytes'] = up_cover.getvalue()
-
-                st.session_state.editor_files[idx]['filename'] = new_fname
-                st.session_state.editor_files[idx]['title'] = new_title
-                st.session_state.editor_files[idx]['artist'] = new_artist
-                st.session_state.editor_files[idx]['album'] = new_album
-
-            with col_img:
-                current_item = st.session_state.editor_files[idx]
-                display_img = current_item['new_cover_bytes'] if current_item['new_cover_bytes'] else current_item['cover_bytes']
-                if display_img:
-                    st.image(display_img, use_container_width=True)
-                else:
-                    st.markdown('<div style="height:100px; background:#333; display:flex; align-items:center; justify-content:center; color:#666;">No Cover</div>', unsafe_allow_html=True)
+                    up_cover = st.file_uploader("画像変更", type=['jpg','png'], key=f"ed_cv_{idx}")
+                    if up_cover:
+                        try:
+                            st.session_state.editor_files[idx]['new_cover_bytes'] = normalize_cover(up_cover.getvalue())
+                        except ValueError as e:
+                            st.error(str(e))
+
+                    st.session_state.editor_files[idx]['filename'] = new_fname
+                    st.session_state.editor_files[idx]['title'] = new_title
+                    st.session_state.editor_files[idx]['artist'] = new_artist
+                    st.session_state.editor_files[idx]['album'] = new_album
+
+                with col_img:
+                    current_item = st.session_state.editor_files[idx]
+                    display_img = current_item['new_cover_bytes'] if current_item['new_cover_bytes'] else current_item['cover_bytes']
+                    display_img = preview_thumbnail(display_img) if display_img else None
+                    if display_img:
+                        st.image(display_img, use_container_width=True)
+                    else:
+                        st.markdown('<div style="height:100px; background:#333; display:flex; align-items:center; justify-content:center; color:#666;">No Cover</div>', unsafe_allow_html=True)
             
-            with col_del:
-                st.markdown("<br>", unsafe_allow_html=True)
-                if st.button("削除", key=f"ed_del_{idx}", type="secondary"):
-                    del st.session_state.editor_files[idx]
-                    st.rerun()
-            st.markdown('</div>', unsafe_allow_html=True)
+                with col_del:
+                    st.markdown("<br>", unsafe_allow_html=True)
+                    if st.button("削除", key=f"ed_del_{idx}", type="secondary"):
+                        removed = st.session_state.editor_files.pop(idx)
+                        # 同じ内容のファイルが他に残っていなければ参照を外す
+                        if all(f['artifact'] != removed['artifact'] for f in st.session_state.editor_files):
+                            artifact_store.release(st.session_state.session_id, [removed['artifact']])
+                        st.rerun()
+                st.markdown('</div>', unsafe_allow_html=True)
 
         if st.button("変更を保存してZIP作成", type="primary", use_container_width=True):
             with st.spinner("処理中..."):
-                with tempfile.TemporaryDirectory() as tmp_dir:
-                    processed_files = []
-                    
-                    for item in st.session_state.editor_files:
-                        safe_name = sanitize_filename(item['filename']) + ".mp3"
-                        file_path = os.path.join(tmp_dir, safe_name)
-                        
-                        with open(file_path, "wb") as f:
-                            f.write(item['file_data'])
-                        
-                        final_cover = item['new_cover_bytes'] if item['new_cover_bytes'] else item['cover_bytes']
-                        apply_id3_tags(
-                            file_path,
-                            title=item['title'],
-                            artist=item['artist'],
-                            album=item['album'],
-                            cover_data=final_cover
-                        )
-                        processed_files.append(safe_name)
-
-                    if processed_files:
-                        zip_io = io.BytesIO()
-                        with zipfile.ZipFile(zip_io, 'w', zipfile.ZIP_DEFLATED) as zf:
-                            for fname in processed_files:
-                                zf.write(os.path.join(tmp_dir, fname), arcname=fname)
-                        st.session_state.editor_processed_zip = zip_io.getvalue()
-                        st.success("作成完了！")
-                        st.rerun()
+                # 前回作成したZIPは破棄し、新しいZIPはディスク上に逐次書き出す
+                session_id = st.session_state.session_id
+                if st.session_state.editor_processed_zip:
+                    artifact_store.release(session_id, [st.session_state.editor_processed_zip])
+                    st.session_state.editor_processed_zip = None
+
+                jobs = []
+                for item in st.session_state.editor_files:
+                    source_path = artifact_store.path(item['artifact'])
+                    if source_path is None:
+                        st.error(f"ファイル {item['original_name']} は保存期限が切れています。再度アップロードしてください。")
+                        continue
+                    jobs.append({
+                        'name': item['original_name'],
+                        'source': source_path,
+                        'arcname': sanitize_filename(item['filename']) + ".mp3",
+                        'title': item['title'],
+                        'artist': item['artist'],
+                        'album': item['album'],
+                        # 既存のカバーはそのまま残し、差し替えた場合だけ書き込む
+                        'cover_data': item['new_cover_bytes'],
+                    })
 
-        if st.session_state.editor_processed_zip:
+                # 他のセッションの処理と実行枠を分け合う (ZIPは元ファイルの合計とほぼ同じ大きさ)
+                wait_notice = st.empty()
+                def on_wait(position):
+                    wait_notice.info(f"順番待ち中です (前に{position}件)")
+                disk_bytes = sum(os.path.getsize(job['source']) for job in jobs)
+
+                # 元ファイルは書き換えず、新しいタグ + 元の音声フレームをZIPエントリへ直接書き出す
+                with default_governor.slot(session_id, disk_bytes, on_wait), \
+                        artifact_store.staging_dir("edit_") as tmp_dir:
+                    wait_notice.empty()
+                    zip_path = os.path.join(tmp_dir, "edited_songs.zip")
+                    with default_metrics.timed('editor_save', items=len(jobs)) as span:
+                        with StreamingZipWriter(zip_path, store_only=settings.ZIP_STORE_ONLY) as zw:
+                            results = write_tagged_batch(jobs, zw)
+                        span['bytes'] = os.path.getsize(zip_path)
+
+                    failed = [(job, r) for job, r in zip(jobs, results) if r['error']]
+                    for job, r in failed:
+                        st.error(f"ファイル {job['name']} のタグ書き込みエラー: {r['error']}")
+
+                    if len(failed) < len(results):
+                        st.session_state.editor_processed_zip = artifact_store.put_file(session_id, zip_path)
+                        if not failed:
+                            st.success("作成完了！")
+                            st.rerun()
+                        st.warning(f"{len(results) - len(failed)}件を保存しました ({len(failed)}件はエラー)")
+
+        if st.session_state.editor_processed_zip and artifact_store.path(st.session_state.editor_processed_zip):
             st.markdown("---")
             st.download_button(
                 label="編集済みファイルをダウンロード (ZIP)",
-                data=st.session_state.editor_processed_zip,
+                data=artifact_store.reader(st.session_state.editor_processed_zip),
                 file_name="edited_songs.zip",
                 mime="application/zip",
                 type="primary",
                 use_container_width=True
             )
+
+# ==========================================
+# 診断情報: 段階ごとの処理時間・バイト数 (プロセス全体の累計)
+# ==========================================
+STAGE_NAMES = {
+    'metadata_batch': "メタデータ解析 (一括)", 'metadata': "メタデータ解析", 'download': "ダウンロード",
+    'transcode': "変換 (ffmpeg)", 'thumbnail': "サムネイル", 'tagging': "タグ書き込み", 'item': "1件全体",
+    'batch': "一括処理全体", 'zip': "ZIP作成", 'editor_save': "タグ編集の保存", 'warmup': "起動時の事前準備",
+}
+
+if show_diagnostics:
+    st.markdown("---")
+    st.markdown('### :material/timer: 診断情報')
+    snapshot = default_metrics.snapshot()
+    if not snapshot['stages']:
+        st.info("まだ計測データがありません")
+    else:
+        st.dataframe(
+            [
+                {
+                    "段階": STAGE_NAMES.get(stage, stage),
+                    "回数": entry['count'],
+                    "エラー": entry['errors'],
+                    "合計 (秒)": round(entry['seconds'], 2),
+                    "平均 (秒)": round(entry['seconds'] / entry['count'], 3),
+                    "最大 (秒)": round(entry['max_seconds'], 3),
+                    "MB": round(entry['bytes'] / 1024 ** 2, 2),
+                }
+                for stage, entry in snapshot['stages'].items()
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+    if snapshot['events']:
+        st.caption(" / ".join(f"{event}: {count}" for event, count in sorted(snapshot['events'].items())))
+    governor_state = default_governor.snapshot()
+    st.caption(
+        f"実行枠: 処理中 {governor_state['running']}/{default_governor.slots}件 · 順番待ち {governor_state['waiting']}件"
+        f" · セッション {governor_state['sessions']} · 一時ディスク見込み {governor_state['disk_used'] / 1024 ** 2:.0f} MB"
+    )
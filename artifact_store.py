@@ -0,0 +1,257 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import settings
+
+# ハッシュ計算・コピー時の読み込み単位
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """ファイル内容のSHA-256 (16進文字列) を返す"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """内容アドレス方式のディスク上アーティファクトストア
+
+    生成したMP3・ZIPやアップロードされたファイルをSHA-256で保存し、
+    セッションステートにはダイジェスト (ハンドル) だけを持たせる。
+    どのセッションが参照しているかをSQLiteで管理し、
+    セッションごとの容量上限・全体のLRU上限・放置セッションの掃除を行う。
+    """
+
+    def __init__(self, root=None, max_bytes=settings.ARTIFACT_MAX_BYTES,
+                 session_max_bytes=settings.ARTIFACT_SESSION_MAX_BYTES,
+                 session_idle=settings.ARTIFACT_SESSION_IDLE):
+        self.root = root or settings.ARTIFACT_DIR
+        self.blob_dir = os.path.join(self.root, "blobs")
+        self.staging_root = os.path.join(self.root, "staging")
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.session_idle = session_idle
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._touched = {}
+        self._live_staging = set()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.staging_root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " digest TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS refs ("
+            " session_id TEXT NOT NULL, digest TEXT NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (session_id, digest));"
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, last_seen REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed_at);"
+            "CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);"
+        )
+        self._conn.commit()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def new_staging_dir(self, prefix="work_"):
+        """ストアと同じファイルシステム上の作業ディレクトリを作る (put_fileでのmoveが安価になる)"""
+        return tempfile.mkdtemp(prefix=prefix, dir=self.staging_root)
+
+    @contextmanager
+    def staging_dir(self, prefix="work_"):
+        """使用中の間は掃除 (cleanup_abandoned) の対象にしない作業ディレクトリを作り、終わったら削除する
+
+        長い一括処理では作業ディレクトリの更新時刻が古いままになるため、時刻だけでは使用中か判断できない。
+        """
+        path = self.new_staging_dir(prefix)
+        with self._lock:
+            self._live_staging.add(path)
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._live_staging.discard(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def put_file(self, session_id, path, digest=None):
+        """ファイルをストアへ移動して登録し、ダイジェストを返す (元ファイルは消える)
+
+        digest が分かっている場合は渡すとハッシュの再計算を省略できる。
+        """
+        digest = digest or file_digest(path)
+        size = os.path.getsize(path)
+        blob_path = self._blob_path(digest)
+        now = time.time()
+        with self._lock:
+            if os.path.exists(blob_path):
+                os.unlink(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                shutil.move(path, blob_path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (digest, size, accessed_at) VALUES (?, ?, ?)",
+                (digest, size, now),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs (session_id, digest, created_at) VALUES (?, ?, ?)",
+                (session_id, digest, now),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, last_seen) VALUES (?, ?)",
+                (session_id, now),
+            )
+            self._evict(session_id, keep=digest)
+            self._conn.commit()
+        return digest
+
+    def put_stream(self, session_id, fileobj, digest=None):
+        """ファイルライクオブジェクトの内容を登録し、ダイジェストを返す"""
+        if digest and self.add_ref(session_id, digest):
+            return digest
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging_root)
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+        return self.put_file(session_id, tmp_path, digest)
+
+    def add_ref(self, session_id, digest):
+        """保存済みのblobにセッションの参照を追加する (blobがなければFalse)"""
+        now = time.time()
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone():
+                return False
+            if not os.path.exists(self._blob_path(digest)):
+                return False
+            self._conn.execute("UPDATE blobs SET accessed_at = ? WHERE digest = ?", (now, digest))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs (session_id, digest, created_at) VALUES (?, ?, ?)",
+                (session_id, digest, now),
+            )
+            self._evict(session_id, keep=digest)
+            self._conn.commit()
+        return True
+
+    def path(self, digest):
+        """ダイジェストに対応するファイルパスを返す (削除済みならNone)"""
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET accessed_at = ? WHERE digest = ?", (time.time(), digest))
+            self._conn.commit()
+        return blob_path
+
+    def reader(self, digest):
+        """st.download_buttonへ渡す遅延読み込み用のコールバックを作る"""
+        def _open():
+            path = self.path(digest)
+            if path is None:
+                return b''
+            return open(path, 'rb')
+        return _open
+
+    def release(self, session_id, digests=None):
+        """セッションの参照を外す (digestsを省略するとすべて)"""
+        with self._lock:
+            if digests is None:
+                self._conn.execute("DELETE FROM refs WHERE session_id = ?", (session_id,))
+            else:
+                self._conn.executemany(
+                    "DELETE FROM refs WHERE session_id = ? AND digest = ?",
+                    [(session_id, d) for d in digests if d],
+                )
+            self._conn.commit()
+
+    def touch_session(self, session_id):
+        """セッションの生存を記録し、時々放置セッションを掃除する"""
+        now = time.time()
+        with self._lock:
+            # 画面の再実行のたびに書き込まないよう、同じセッションの記録は1分に1回まで
+            if now - self._touched.get(session_id, 0.0) >= 60:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, last_seen) VALUES (?, ?)",
+                    (session_id, now),
+                )
+                self._conn.commit()
+                self._touched[session_id] = now
+            if now - self._last_cleanup < 60:
+                return
+            self._last_cleanup = now
+        self.cleanup_abandoned()
+
+    def cleanup_abandoned(self):
+        """一定時間アクセスのないセッションの参照と、古い作業ディレクトリを削除する"""
+        cutoff = time.time() - self.session_idle
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT session_id FROM sessions WHERE last_seen < ?", (cutoff,))]
+            for session_id in stale:
+                self._conn.execute("DELETE FROM refs WHERE session_id = ?", (session_id,))
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._touched.pop(session_id, None)
+            self._evict()
+            self._conn.commit()
+            live = set(self._live_staging)
+
+        for name in os.listdir(self.staging_root):
+            path = os.path.join(self.staging_root, name)
+            if path in live:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.unlink(path)
+            except OSError:
+                pass
+
+    def _delete_blob(self, digest):
+        self._conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+        self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.unlink(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, session_id=None, keep=None):
+        # ロック取得済みの状態で呼ぶこと
+
+        # 1. セッションごとの上限: そのセッションの古い参照から外す
+        if session_id is not None:
+            rows = self._conn.execute(
+                "SELECT refs.digest, blobs.size FROM refs JOIN blobs ON refs.digest = blobs.digest"
+                " WHERE refs.session_id = ? ORDER BY refs.created_at", (session_id,)).fetchall()
+            total = sum(size for _, size in rows)
+            for digest, size in rows:
+                if total <= self.session_max_bytes:
+                    break
+                if digest == keep:
+                    continue
+                self._conn.execute("DELETE FROM refs WHERE session_id = ? AND digest = ?", (session_id, digest))
+                total -= size
+
+        # 2. 全体の上限: 参照のないものを優先し、最終アクセスの古い順に削除
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT digest, size, EXISTS (SELECT 1 FROM refs WHERE refs.digest = blobs.digest) AS referenced"
+            " FROM blobs ORDER BY referenced, accessed_at").fetchall()
+        for digest, size, _ in rows:
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            self._delete_blob(digest)
+            total -= size
@@ -0,0 +1,148 @@
+import json
+import re
+import subprocess
+
+import settings
+
+# 音量の正規化・無音の削除・切り出しを、音声の変換と同じ1回のffmpeg実行で行う。
+# (yt-dlpのFFmpegExtractAudioは、元の音声が出力形式と同じコーデックだとコピーするだけで
+#  フィルタを掛けられないため、加工するときは変換そのものをここで行う)
+# 末尾の無音を削るときだけ、その位置を調べるデコードのみの実行を先に1回行う。
+
+# これより短い無音は末尾の無音とみなさない (秒)
+_MIN_TRAILING_SILENCE = 0.1
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[0-9.]+)")
+
+
+def parse_timestamp(text):
+    """'1:23' / '1:02:03' / '83' / '83.5' 形式の時刻を秒にする (空ならNone)"""
+    text = (text or '').strip()
+    if not text:
+        return None
+    try:
+        parts = [float(part) for part in text.split(':')]
+    except ValueError:
+        parts = []
+    if not 1 <= len(parts) <= 3 or any(part < 0 for part in parts) or any(part >= 60 for part in parts[1:]):
+        raise ValueError(f"時刻の形式が正しくありません: {text} (例: 1:23)")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def format_timestamp(seconds):
+    """秒を 'm:ss' 形式にする"""
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def filter_spec(info, options):
+    """アイテムに掛ける加工の内容を返す (加工しないならNone)
+
+    info の custom_start / custom_end (切り出す範囲)、
+    options の normalize / loudness (音量の正規化と目標ラウドネス LUFS)・trim_silence (前後の無音の削除) を見る。
+    """
+    spec = {}
+    start = parse_timestamp(info.get('custom_start'))
+    end = parse_timestamp(info.get('custom_end'))
+    if start:
+        spec['start'] = start
+    if end is not None:
+        if end <= (start or 0):
+            raise ValueError("切り出しの終了は開始より後にしてください")
+        spec['end'] = end
+    if options.get('trim_silence'):
+        spec['trim_silence'] = True
+    if options.get('normalize'):
+        spec['loudness'] = float(options.get('loudness', settings.NORMALIZE_LOUDNESS))
+    return spec or None
+
+
+def variant_key(spec):
+    """変換キャッシュのキーに含める加工内容の文字列 (加工しないなら空)"""
+    return json.dumps(spec, sort_keys=True) if spec else ''
+
+
+def _range_args(spec):
+    # 入力側の -ss/-to はシークしてからデコードするので、切り出す範囲の外はデコードしない
+    args = []
+    if 'start' in spec:
+        args += ['-ss', str(spec['start'])]
+    if 'end' in spec:
+        args += ['-to', str(spec['end'])]
+    return args
+
+
+def _run_ffmpeg(command):
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise RuntimeError(f"音声の変換に失敗しました: {message[-1] if message else result.returncode}")
+    return result
+
+
+def trailing_silence_start(src, spec):
+    """切り出す範囲の末尾に続く無音の開始位置 (元の音声での秒) を返す (末尾が無音でなければNone)
+
+    silencedetect は読み進めながら判定するため、曲全体をメモリに展開しない
+    (areverse で反転して先頭の無音として削ると、長い曲ほどメモリを使う)。
+    """
+    result = _run_ffmpeg(
+        ['ffmpeg', '-hide_banner', '-nostats', '-progress', 'pipe:1', *_range_args(spec), '-i', src, '-vn',
+         '-af', f"silencedetect=n={settings.SILENCE_THRESHOLD}dB:d={_MIN_TRAILING_SILENCE}", '-f', 'null', '-'])
+    # 無音が最後まで続いた場合も、ストリームの終わりの時刻で silence_end が出る。終わりの時刻は進捗の最後の値
+    stream_end = None
+    for line in result.stdout.decode().splitlines():
+        key, _, value = line.partition('=')
+        if key == 'out_time_us' and value.isdigit():
+            stream_end = int(value) / 1e6
+    silence_start = silence_end = None
+    for kind, value in _SILENCE_RE.findall(result.stderr.decode('utf-8', 'replace')):
+        if kind == 'start':
+            silence_start, silence_end = float(value), None
+        else:
+            silence_end = float(value)
+    if silence_start is None or stream_end is None:
+        return None
+    if silence_end is not None and silence_end < stream_end - 0.05:
+        return None
+    return spec.get('start', 0) + max(silence_start, 0.0)
+
+
+def _audio_filters(spec):
+    filters = []
+    if spec.get('trim_silence'):
+        # 先頭の無音だけを削る (末尾は trailing_silence_start で調べた位置で -to により切る)
+        filters.append(f"silenceremove=start_periods=1:start_threshold={settings.SILENCE_THRESHOLD}dB")
+    if 'loudness' in spec:
+        # EBU R128 の1パス (動的) 正規化。loudnormは内部で192kHzへ上げるため、出力のサンプルレートを戻す
+        filters.append(
+            f"loudnorm=I={spec['loudness']}:TP={settings.NORMALIZE_TRUE_PEAK}:LRA={settings.NORMALIZE_LRA}")
+        filters.append('aresample=48000')
+    return filters
+
+
+def build_command(src, dest, output_format, quality, spec):
+    """src を加工しつつ output_format へ変換するffmpegのコマンドを作る (デコード・エンコードは1回)"""
+    from yt_dlp.postprocessor.ffmpeg import ACODECS
+
+    _, encoder, _ = ACODECS[output_format]
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *_range_args(spec)]
+    command += ['-i', src, '-vn', '-acodec', encoder]
+    # ビットレートの指定はFFmpegExtractAudioと同じ (最高音質ならエンコーダーの既定値)
+    if quality != '0':
+        command += ['-b:a', f'{quality}k']
+    filters = _audio_filters(spec)
+    if filters:
+        command += ['-af', ','.join(filters)]
+    return command + [dest]
+
+
+def render(src, dest, output_format, quality, spec):
+    """加工と変換を1回のffmpeg実行で行う (末尾の無音を削るときは、先にその位置を調べて切り出す範囲を縮める)"""
+    if spec.get('trim_silence'):
+        tail = trailing_silence_start(src, spec)
+        if tail is not None and tail > spec.get('start', 0):
+            spec = dict(spec, end=tail)
+    _run_ffmpeg(build_command(src, dest, output_format, quality, spec))
@@ -0,0 +1,28 @@
+"""ベンチマーク用のローカルHTTPサーバー (ネットワークを使わずに音源を配信する)"""
+import functools
+import http.server
+import sys
+import threading
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    # keep-aliveで接続を使い回す (yt-dlpの接続の再利用も計測に含める)
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # ワーカープロセスの終了でkeep-aliveの接続が切れるのは想定どおり
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(directory):
+    """directory を配信するサーバーを別スレッドで起動する (空いているポートを使う。server_address で確認)"""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = _QuietServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,124 @@
+"""起動直後の応答時間の計測 (ネットワーク不要)
+
+使い方:
+    python bench/startup.py [--runs 3] [--reruns 20]
+
+ケースごとに新しいプロセスで計測し、中央値を表示する。
+- 初回表示: Streamlitのスクリプトを初めて実行し終えるまで (アプリが読み込むモジュールの import を含む)。
+            表示までに yt_dlp を読み込んだかも表示する
+- 再実行: 2回目以降の再実行1回あたりの時間 (操作のたびにかかる分)
+- 最初の解析: 起動直後の最初のメタデータ解析 (resolve_metadata) の時間。
+              事前準備 (pipeline.warm_up) を済ませた場合と比べる
+解析はローカルのHTTPサーバーに置いた音源を、yt-dlpの汎用抽出器で解析する。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_server import serve  # noqa: E402
+
+CASES = ('app', 'first_request', 'first_request_warm')
+
+
+class _NoCache:
+    # メタデータキャッシュを無効にして、毎回yt-dlpで解析させる
+    def get(self, url):
+        return None
+
+    def set(self, url, info):
+        return {'title': info.get('title')}
+
+
+def run_app(args):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    started = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - started
+    loaded_ytdlp = 'yt_dlp' in sys.modules
+
+    started = time.perf_counter()
+    for _ in range(args.reruns):
+        at.run()
+    rerun = (time.perf_counter() - started) / args.reruns
+    return {'first': first, 'rerun': rerun, 'yt_dlp': loaded_ytdlp}
+
+
+def run_first_request(args):
+    import pipeline
+    from scheduler import RequestScheduler
+
+    # レート制限の待ち時間を計測に含めない
+    pipeline.default_scheduler = RequestScheduler(rate=1000, burst=1000)
+    if args.worker == 'first_request_warm':
+        pipeline.warm_up()
+    started = time.perf_counter()
+    [(meta, error)] = pipeline.resolve_metadata([args.url], None, _NoCache(), workers=1)
+    if error:
+        raise RuntimeError(error)
+    return {'first': time.perf_counter() - started}
+
+
+def worker(args):
+    runner = run_app if args.worker == 'app' else run_first_request
+    print(json.dumps(runner(args)))
+    return 0
+
+
+def run_case(case, args, url):
+    env = dict(os.environ, AUDIO_DL_WARMUP='0')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env['AUDIO_DL_CACHE_DIR'] = cache_dir
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', case, '--url', url, '--reruns', str(args.reruns)],
+            capture_output=True, text=True, env=env, cwd=ROOT,
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{case} が失敗しました:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help="ケースごとの実行回数 (中央値を表示)")
+    parser.add_argument('--reruns', type=int, default=20, help="再実行の計測回数")
+    parser.add_argument('--worker', choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        return worker(args)
+
+    with tempfile.TemporaryDirectory() as source_dir:
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=d=1',
+             '-c:a', 'libmp3lame', os.path.join(source_dir, "tone.mp3")],
+            check=True,
+        )
+        server = serve(source_dir)
+        url = f"http://127.0.0.1:{server.server_address[1]}/tone.mp3"
+        results = {case: [run_case(case, args, url) for _ in range(args.runs)] for case in CASES}
+        server.shutdown()
+
+    def median_ms(case, key):
+        return statistics.median(r[key] for r in results[case]) * 1000
+
+    print(f"中央値 ({args.runs}回)")
+    print(f"初回表示            {median_ms('app', 'first'):>8.1f} ms"
+          f"  (yt_dlpの読み込み: {'あり' if any(r['yt_dlp'] for r in results['app']) else 'なし'})")
+    print(f"再実行 (1回あたり)  {median_ms('app', 'rerun'):>8.1f} ms")
+    print(f"最初の解析          {median_ms('first_request', 'first'):>8.1f} ms")
+    print(f"最初の解析 (準備後) {median_ms('first_request_warm', 'first'):>8.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
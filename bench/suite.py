@@ -0,0 +1,314 @@
+"""ダウンロード・タグ編集・ZIP作成の各経路のベンチマーク (ネットワーク不要)
+
+使い方:
+    python bench/suite.py [--paths download,tag_edit,archive] [--sizes 1,10,100] [--output results.jsonl]
+    python bench/suite.py --compare results.jsonl      # 前回の結果と比べる
+
+- download: 生成した音源をローカルのHTTPサーバーから配信し、yt-dlpの汎用抽出器を実際のサイトの代わりにして
+            メタデータ解析 (resolve_metadata) からダウンロード・変換・タグ付け (download_batch) までを通す
+- tag_edit: タグ・カバー画像の大きさが異なるMP3を用意し、タグ編集の保存 (write_tagged_batch → ZIP) を通す
+- archive:  完成したファイルをZIPへまとめる (StreamingZipWriter)
+
+ケース (経路 x 件数) ごとに別プロセスで実行し、経過時間・スループット・最大RSS (自プロセスと子プロセスのうち大きい方) と段階ごとの処理時間を計測する。
+結果は1ケース1行のJSON Linesで書き出すので、--output に追記していけば時系列で比較できる。
+download には ffmpeg が PATH にあること (tag_edit・archive のフィクスチャはffmpegなしで作る)。
+"""
+import argparse
+import io
+import json
+import math
+import multiprocessing.forkserver
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_server import serve  # noqa: E402
+
+PATHS = ('download', 'tag_edit', 'archive')
+# タグ編集用のフィクスチャ: (名前, カバー画像の一辺 (0ならなし), タグの文字数)
+FIXTURE_VARIANTS = [
+    ('plain', 0, 16),
+    ('long_tags', 0, 2000),
+    ('small_cover', 300, 16),
+    ('large_cover', 1200, 16),
+    ('large_cover_long_tags', 1200, 2000),
+]
+
+
+# ── フィクスチャ ──
+# 無音のMP3フレーム (MPEG-1 Layer III・128kbps・44.1kHz・ステレオ、本体はすべて0)。
+# タグ編集・ZIP作成は音声の中身を読まないので、ffmpegなしで作れるこれで足りる
+_SILENT_FRAME = bytes.fromhex('fffb9004') + bytes(144 * 128000 // 44100 - 4)
+_SAMPLES_PER_FRAME = 1152
+
+
+def make_silent_mp3(path, duration):
+    with open(path, 'wb') as f:
+        f.write(_SILENT_FRAME * math.ceil(duration * 44100 / _SAMPLES_PER_FRAME))
+
+
+def make_audio(path, duration):
+    # download で配信する音源 (変換の負荷が実際の音声に近くなるよう、ffmpegで正弦波をエンコードする)
+    subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f'sine=f=440:d={duration}',
+         '-c:a', 'libmp3lame', '-b:a', '128k', path],
+        check=True,
+    )
+
+
+def make_cover(size, seed):
+    # ノイズ画像はJPEGでもほとんど縮まないので、大きなカバー画像の代わりになる
+    from PIL import Image
+
+    data = random.Random(seed).randbytes(size * size * 3)
+    buf = io.BytesIO()
+    Image.frombytes('RGB', (size, size), data).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def make_fixtures(directory, duration, with_source):
+    """タグ・カバー画像の大きさが異なるタグ編集用MP3と、with_source なら配信用の音源 (source.mp3) を作る"""
+    from mutagen.id3 import APIC, COMM, ID3, TALB, TIT2, TPE1
+
+    if with_source:
+        make_audio(os.path.join(directory, "source.mp3"), duration)
+    silent = os.path.join(directory, "silent.mp3")
+    make_silent_mp3(silent, duration)
+    for name, cover_size, text_length in FIXTURE_VARIANTS:
+        path = os.path.join(directory, f"{name}.mp3")
+        shutil.copyfile(silent, path)
+        text = ("あいうえおabcde" * text_length)[:text_length]
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text=text))
+        tags.add(TPE1(encoding=3, text=text))
+        tags.add(TALB(encoding=3, text=text))
+        tags.add(COMM(encoding=3, lang='jpn', desc='', text=text))
+        if cover_size:
+            tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=make_cover(cover_size, cover_size)))
+        tags.save(path)
+
+
+# ── 各経路 (ワーカープロセス内で実行) ──
+def run_download(items, args, work_dir):
+    import pipeline
+    from metadata_cache import MetadataCache
+    from scheduler import RequestScheduler
+    from transcode_cache import TranscodeCache
+
+    # レート制限の待ち時間は計測に含めない
+    pipeline.default_scheduler = RequestScheduler(rate=1000, burst=1000)
+    # 実行ごとにURLを変え、変換キャッシュ・メタデータキャッシュが効かない状態で計測する
+    urls = [f"{args.base_url}/source.mp3?run={os.getpid()}&n={i}" for i in range(items)]
+    resolved = pipeline.resolve_metadata(urls, None, MetadataCache())
+    info_list = [pipeline.make_info(url, meta) for url, (meta, _) in zip(urls, resolved) if meta]
+    for i, info in enumerate(info_list):
+        info['custom_filename'] = f"track{i}"
+    options = {'quality': '0', 'embed_thumb': True, 'format': 'mp3', 'max_workers': args.workers}
+    results = pipeline.download_batch(info_list, options, work_dir, None, TranscodeCache(), lambda *a: None)
+    paths = [result['path'] for result in results if result['path']]
+    return len(paths), sum(os.path.getsize(path) for path in paths)
+
+
+def run_tag_edit(items, args, work_dir):
+    import settings
+    from metrics import default_metrics
+    from tagging import write_tagged_batch
+    from zip_stream import StreamingZipWriter
+
+    new_cover = make_cover(600, 1)
+    jobs = []
+    for i in range(items):
+        name = FIXTURE_VARIANTS[i % len(FIXTURE_VARIANTS)][0]
+        jobs.append({
+            'source': os.path.join(args.fixtures, f"{name}.mp3"),
+            'arcname': f"track{i}.mp3",
+            'title': f"Title {i}",
+            'artist': "Artist",
+            'album': "Album",
+            # 半分はカバー画像を差し替える
+            'cover_data': new_cover if i % 2 else None,
+        })
+    zip_path = os.path.join(work_dir, "edited.zip")
+    # アプリのタグ編集の保存と同じ段階名で計測する
+    with default_metrics.timed('editor_save', items=items) as span:
+        with StreamingZipWriter(zip_path, store_only=settings.ZIP_STORE_ONLY) as zw:
+            results = write_tagged_batch(jobs, zw)
+        span['bytes'] = os.path.getsize(zip_path)
+    return sum(1 for result in results if not result['error']), os.path.getsize(zip_path)
+
+
+def run_archive(items, args, work_dir):
+    import settings
+    from metrics import default_metrics
+    from zip_stream import StreamingZipWriter
+
+    sources = [os.path.join(args.fixtures, f"{name}.mp3") for name, _, _ in FIXTURE_VARIANTS]
+    zip_path = os.path.join(work_dir, "archive.zip")
+    # ジョブの結果をまとめるZIPと同じ段階名で計測する
+    with default_metrics.timed('zip', items=items) as span:
+        with StreamingZipWriter(zip_path, store_only=settings.ZIP_STORE_ONLY) as zw:
+            for i in range(items):
+                zw.add_file(sources[i % len(sources)], f"track{i}.mp3")
+        span['bytes'] = os.path.getsize(zip_path)
+    return items, os.path.getsize(zip_path)
+
+
+RUNNERS = {'download': run_download, 'tag_edit': run_tag_edit, 'archive': run_archive}
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """最大RSS (MB)。RUSAGE_CHILDREN は終了した子プロセス (タグ付けのプロセスプール・ffmpeg) のうち最大の1つ"""
+    rss = resource.getrusage(who).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def worker(args):
+    """1ケースを実行し、結果を1行のJSONで標準出力へ書き出す"""
+    from metrics import default_metrics
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        started = time.perf_counter()
+        succeeded, nbytes = RUNNERS[args.worker](args.items, args, work_dir)
+        wall = time.perf_counter() - started
+    stages = default_metrics.snapshot()['stages']
+    # タグ付けのプロセスプールはforkserver経由で起動するため、ワーカーはforkserverの子プロセスになる。
+    # forkserverを止めて回収すると、ワーカーの最大RSSも RUSAGE_CHILDREN に含まれる
+    forkserver = getattr(multiprocessing.forkserver, '_forkserver', None)
+    if hasattr(forkserver, '_stop'):
+        forkserver._stop()
+    self_rss = peak_rss_mb()
+    children_rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    print(json.dumps({
+        'path': args.worker,
+        'items': args.items,
+        'succeeded': succeeded,
+        'wall_sec': round(wall, 4),
+        'items_per_sec': round(succeeded / wall, 2) if wall else None,
+        'mb_per_sec': round(nbytes / 1024 ** 2 / wall, 2) if wall else None,
+        'output_mb': round(nbytes / 1024 ** 2, 3),
+        # 件数によって子プロセスで処理する経路があるため、大きい方を比較に使う
+        'peak_rss_mb': round(max(self_rss, children_rss), 1),
+        'peak_rss_self_mb': round(self_rss, 1),
+        'peak_rss_children_mb': round(children_rss, 1),
+        'stage_sec': {stage: round(entry['seconds'], 4) for stage, entry in stages.items()},
+    }))
+    return 0
+
+
+# ── 親プロセス: フィクスチャの用意・各ケースの起動・結果の出力 ──
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(path, items, args, fixtures, base_url):
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # キャッシュはケースごとに空の状態から始める
+        env['AUDIO_DL_CACHE_DIR'] = cache_dir
+        env.pop('AUDIO_DL_METRICS_LOG', None)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', path, '--items', str(items),
+             '--fixtures', fixtures, '--base-url', base_url, '--workers', str(args.workers)],
+            env=env, capture_output=True, text=True,
+        )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise RuntimeError(f"{path} x {items} が失敗しました")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def load_baseline(path):
+    """比較用: (経路, 件数) ごとに最後の結果"""
+    baseline = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                baseline[(record['path'], record['items'])] = record
+    return baseline
+
+
+def print_table(records, baseline):
+    header = f"{'経路':<10} {'件数':>5} {'経過秒':>9} {'件/秒':>8} {'MB/秒':>8} {'最大RSS(MB)':>12}"
+    if baseline:
+        header += f" {'経過秒の比':>10}"
+    print(header, file=sys.stderr)
+    for r in records:
+        line = (f"{r['path']:<10} {r['items']:>5} {r['wall_sec']:>9.3f} {r['items_per_sec'] or 0:>8.1f}"
+                f" {r['mb_per_sec'] or 0:>8.1f} {r['peak_rss_mb']:>12.1f}")
+        if baseline:
+            before = baseline.get((r['path'], r['items']))
+            line += f" {r['wall_sec'] / before['wall_sec']:>10.2f}" if before and before['wall_sec'] else f" {'-':>10}"
+        print(line, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--paths', default=",".join(PATHS), help="計測する経路 (カンマ区切り)")
+    parser.add_argument('--sizes', default="1,10,100", help="一括処理の件数 (カンマ区切り)")
+    parser.add_argument('--duration', type=int, default=30, help="音源の長さ (秒)")
+    parser.add_argument('--workers', type=int, default=4, help="download の同時ダウンロード数")
+    parser.add_argument('--output', help="結果を追記するJSON Linesファイル")
+    parser.add_argument('--compare', help="比較する過去の結果 (JSON Lines)")
+    # 以下はワーカープロセス用
+    parser.add_argument('--worker', choices=PATHS, help=argparse.SUPPRESS)
+    parser.add_argument('--items', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--fixtures', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return worker(args)
+
+    paths = [p for p in args.paths.split(",") if p]
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        parser.error(f"不明な経路: {', '.join(sorted(unknown))}")
+    sizes = [int(n) for n in args.sizes.split(",") if n]
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    run_info = {
+        'ts': time.time(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'duration': args.duration,
+    }
+    records = []
+    with tempfile.TemporaryDirectory() as fixtures:
+        make_fixtures(fixtures, args.duration, with_source='download' in paths)
+        server = serve(fixtures)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        for path in paths:
+            for items in sizes:
+                record = {**run_info, **run_case(path, items, args, fixtures, base_url)}
+                records.append(record)
+                print(json.dumps(record, ensure_ascii=False))
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print_table(records, baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""出力形式ごとの1曲あたりCPU時間の比較 (変換不要な経路 vs MP3への強制変換)
+
+使い方:
+    python bench/transcode_paths.py [--duration 180] [--tracks 3]
+
+ffmpeg が PATH にあること。ネットワークは使わず、ffmpegで生成した音源 (AAC/Opus) を
+ローカルのHTTPサーバーから配信し、pipeline.download_item を実際に通して計測する。
+CPU時間は自プロセスと子プロセス (ffmpeg) の user + sys の合計。
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_server import serve  # noqa: E402
+from pipeline import ProgressHooks, download_item  # noqa: E402
+from transcode_cache import TranscodeCache  # noqa: E402
+
+# (元の音源, ffmpegのエンコード引数)
+SOURCES = {
+    'src.m4a': ['-c:a', 'aac', '-b:a', '160k'],
+    'src.opus': ['-c:a', 'libopus', '-b:a', '160k'],
+}
+# (元の音源, 出力形式): MP3は常に再エンコード、それ以外は同じコーデックなので変換不要
+CASES = [
+    ('src.m4a', 'mp3'),
+    ('src.m4a', 'm4a'),
+    ('src.opus', 'mp3'),
+    ('src.opus', 'opus'),
+]
+
+
+def cpu_seconds():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def make_sources(directory, duration):
+    for name, codec_args in SOURCES.items():
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f'anoisesrc=d={duration}:a=0.1',
+             *codec_args, os.path.join(directory, name)],
+            check=True,
+        )
+
+
+def run_case(base_url, source, output_format, tracks, work_root):
+    cpu = []
+    wall = []
+    for i in range(tracks):
+        # 毎回新しいキャッシュを使い、変換結果の再利用を計測に含めない
+        work_dir = tempfile.mkdtemp(dir=work_root)
+        cache = TranscodeCache(root=os.path.join(work_dir, "cache"))
+        info = {'url': f"{base_url}/{source}?track={i}", 'custom_filename': f"track{i}",
+                'custom_title': f"Track {i}", 'custom_artist': "bench", 'custom_album': ""}
+        options = {'quality': '0', 'embed_thumb': False, 'format': output_format}
+        hooks = ProgressHooks(i, lambda *args: None)
+
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        download_item(info, work_dir, options, None, cache, hooks)
+        cpu.append(cpu_seconds() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+    return sum(cpu) / tracks, sum(wall) / tracks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=int, default=180, help="音源の長さ (秒)")
+    parser.add_argument('--tracks', type=int, default=3, help="ケースごとの曲数")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as root:
+        source_dir = os.path.join(root, "sources")
+        os.makedirs(source_dir)
+        make_sources(source_dir, args.duration)
+        server = serve(source_dir)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        results = {}
+        for source, output_format in CASES:
+            results[(source, output_format)] = run_case(base_url, source, output_format, args.tracks, root)
+        server.shutdown()
+
+    print(f"1曲あたりの平均 ({args.duration}秒の音源 x {args.tracks}曲)")
+    print(f"{'元の音源':<10} {'出力':<6} {'CPU秒':>8} {'経過秒':>8} {'MP3比CPU':>9}")
+    for source, output_format in CASES:
+        cpu, wall = results[(source, output_format)]
+        forced_cpu = results[(source, 'mp3')][0]
+        ratio = f"{cpu / forced_cpu:.1%}" if forced_cpu else "-"
+        print(f"{source:<10} {output_format:<6} {cpu:>8.3f} {wall:>8.3f} {ratio:>9}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
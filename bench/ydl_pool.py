@@ -0,0 +1,91 @@
+"""YoutubeDLのプールによる1件あたりの処理時間の比較 (毎回新しいインスタンス vs プールから再利用)
+
+使い方:
+    python bench/ydl_pool.py [--items 30]
+
+ネットワークは使わず、ローカルのHTTPサーバー (keep-alive対応) に置いた短い音源に対して
+pipeline.resolve_metadata と pipeline.download_item を1件ずつ順に実行し、平均時間を比べる。
+スケジューラのレート制限は外して計測する。
+ffmpeg が PATH にあること。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline  # noqa: E402
+from local_server import serve  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+from transcode_cache import TranscodeCache  # noqa: E402
+from ydl_pool import YoutubeDLPool  # noqa: E402
+
+
+class _NoCache:
+    # メタデータキャッシュを無効にして、毎回yt-dlpで解析させる
+    def get(self, url):
+        return None
+
+    def set(self, url, info):
+        return {'title': info.get('title')}
+
+
+def run(pool, urls, root):
+    pipeline.default_pool = pool
+    # レート制限の待ち時間を計測に含めない
+    pipeline.default_scheduler = RequestScheduler(rate=1000, burst=1000)
+    started = time.perf_counter()
+    for url in urls:
+        pipeline.resolve_metadata([url], None, _NoCache(), workers=1)
+    metadata = (time.perf_counter() - started) / len(urls)
+
+    started = time.perf_counter()
+    for i, url in enumerate(urls):
+        work_dir = tempfile.mkdtemp(dir=root)
+        info = {'url': url, 'custom_filename': f"track{i}", 'custom_title': "", 'custom_artist': "", 'custom_album': ""}
+        options = {'quality': '0', 'embed_thumb': False, 'format': 'mp3'}
+        cache = TranscodeCache(root=os.path.join(work_dir, "cache"))
+        pipeline.download_item(info, work_dir, options, None, cache, pipeline.ProgressHooks(i, lambda *args: None))
+    download = (time.perf_counter() - started) / len(urls)
+    pool.close()
+    return metadata, download
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=30, help="件数")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as root:
+        source_dir = os.path.join(root, "sources")
+        os.makedirs(source_dir)
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=d=5',
+             '-c:a', 'libmp3lame', '-b:a', '128k', os.path.join(source_dir, "tone.mp3")],
+            check=True,
+        )
+        server = serve(source_dir)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/tone.mp3"
+
+        results = {}
+        for label, pool in (
+            ("毎回新規", YoutubeDLPool(max_idle=0, cachedir=os.path.join(root, "ydl-cache"))),
+            ("プール", YoutubeDLPool(cachedir=os.path.join(root, "ydl-cache"))),
+        ):
+            # 解析結果の再利用が起きないよう、実行ごとにURLを変える
+            urls = [f"{base_url}?run={label}&n={i}" for i in range(args.items)]
+            results[label] = run(pool, urls, root)
+        server.shutdown()
+
+    print(f"1件あたりの平均 ({args.items}件を順に処理)")
+    print(f"{'':<8} {'解析 (ms)':>10} {'ダウンロード (ms)':>18}")
+    for label, (metadata, download) in results.items():
+        print(f"{label:<8} {metadata * 1000:>10.1f} {download * 1000:>18.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
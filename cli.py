@@ -0,0 +1,235 @@
+"""ヘッドレス一括ダウンロード (Streamlitを使わずに同じパイプラインを実行する)
+
+使い方:
+    python cli.py URL [URL ...] -o out_dir
+    python cli.py -i urls.txt --zip archive.zip -j 4
+    python cli.py --csv tracks.csv -o out_dir
+    python cli.py URL -o out_dir --format m4a
+    python cli.py -i urls.txt -o out_dir --normalize --trim-silence
+
+CSVの列: url (必須), filename, title, artist, album, cover (画像ファイルのパス), start, end (切り出す範囲 m:ss)。
+空欄の項目は動画のメタデータから補完する。
+終了時に結果のサマリー (JSON、段階ごとの処理時間を含む) を標準出力へ書き出す。全件成功なら終了コード0、失敗があれば1。
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import settings
+from audio_filters import filter_spec
+from covers import normalize_cover
+from metadata_cache import MetadataCache
+from metrics import default_metrics
+from pipeline import OUTPUT_FORMATS, download_batch, make_info, resolve_metadata, cookie_file, sanitize_filename
+from transcode_cache import TranscodeCache
+from zip_stream import StreamingZipWriter
+
+QUALITY_CHOICES = ('0', '192', '128')
+OVERRIDE_FIELDS = {
+    'filename': 'custom_filename',
+    'title': 'custom_title',
+    'artist': 'custom_artist',
+    'album': 'custom_album',
+}
+# 切り出す範囲 (メタデータからは補完しない)
+CLIP_FIELDS = {
+    'start': 'custom_start',
+    'end': 'custom_end',
+}
+
+
+def read_requests(args):
+    """コマンドライン引数・URLリスト・CSVから {'url', 上書き項目...} のリストを作る"""
+    requests = [{'url': url} for url in args.urls]
+
+    if args.input:
+        with open(args.input, encoding='utf-8') if args.input != '-' else sys.stdin as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    requests.append({'url': line})
+
+    if args.csv:
+        with open(args.csv, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                row = {k.strip().lower(): (v or '').strip() for k, v in row.items() if k}
+                if row.get('url'):
+                    requests.append(row)
+
+    return requests
+
+
+def build_info_list(requests, cookie_path, workers):
+    """メタデータを補完してパイプライン用のアイテムを作る。(アイテム or None, エラー) のリストを返す"""
+    # すべての項目が指定済みのものはメタデータ取得を省略する
+    need_meta = [r for r in requests if not all(r.get(f) for f in OVERRIDE_FIELDS)]
+    resolved = dict(zip(
+        (id(r) for r in need_meta),
+        resolve_metadata([r['url'] for r in need_meta], cookie_path, MetadataCache(), workers),
+    ))
+
+    entries = []
+    for request in requests:
+        meta, error = resolved.get(id(request), ({}, None))
+        if error or meta is None:
+            entries.append((None, error or "情報の取得に失敗しました"))
+            continue
+        info = make_info(request['url'], meta)
+        for field, key in {**OVERRIDE_FIELDS, **CLIP_FIELDS}.items():
+            if request.get(field):
+                info[key] = request[field]
+        try:
+            filter_spec(info, {})
+        except ValueError as e:
+            entries.append((None, str(e)))
+            continue
+        if request.get('cover'):
+            try:
+                with open(request['cover'], 'rb') as f:
+                    info['custom_cover_bytes'] = normalize_cover(f.read())
+            except (OSError, ValueError) as e:
+                entries.append((None, f"カバー画像を読み込めません: {e}"))
+                continue
+        entries.append((info, None))
+    return entries
+
+
+def unique_path(directory, filename):
+    """出力先で同名ファイルが衝突しないよう連番を付与"""
+    base, ext = os.path.splitext(filename)
+    candidate = filename
+    n = 2
+    while os.path.exists(os.path.join(directory, candidate)):
+        candidate = f"{base} ({n}){ext}"
+        n += 1
+    return os.path.join(directory, candidate)
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="YouTubeの音声を一括ダウンロードします")
+    parser.add_argument('urls', nargs='*', help="ダウンロードするURL")
+    parser.add_argument('-i', '--input', help="URLを1行ずつ書いたファイル ('-' で標準入力)")
+    parser.add_argument('--csv', help="曲ごとの設定を書いたCSV (url, filename, title, artist, album, cover, start, end)")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('-o', '--output-dir', help="音声ファイルの出力先ディレクトリ")
+    output.add_argument('--zip', help="出力するZIPファイルのパス")
+    parser.add_argument('-f', '--format', choices=list(OUTPUT_FORMATS), default='mp3',
+                        help="出力形式 (m4a・opusは元の音声をそのまま使えれば変換しない)")
+    parser.add_argument('-q', '--quality', choices=QUALITY_CHOICES, default='0', help="ビットレート (0 = 最高)")
+    parser.add_argument('-j', '--jobs', type=int, default=3, help="同時ダウンロード数")
+    parser.add_argument('--normalize', action='store_true', help="音量を揃える (EBU R128)")
+    parser.add_argument('--loudness', type=float, default=settings.NORMALIZE_LOUDNESS,
+                        help="--normalize の目標ラウドネス (LUFS)")
+    parser.add_argument('--trim-silence', action='store_true', help="前後の無音を削除する")
+    parser.add_argument('--no-thumbnail', action='store_true', help="サムネイルを埋め込まない")
+    parser.add_argument('--cookies', help="Netscape形式のCookieファイル")
+    parser.add_argument('--deflate', action='store_true', help="ZIPをDEFLATEで圧縮する (既定は無圧縮)")
+    args = parser.parse_args(argv)
+    if not (args.urls or args.input or args.csv):
+        parser.error("URL、--input、--csv のいずれかを指定してください")
+    if args.jobs < 1:
+        parser.error("--jobs は1以上を指定してください")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.time()
+    requests = read_requests(args)
+
+    cookie_content = None
+    if args.cookies:
+        with open(args.cookies, encoding='utf-8') as f:
+            cookie_content = f.read()
+
+    options = {
+        'quality': args.quality,
+        'embed_thumb': not args.no_thumbnail,
+        'max_workers': args.jobs,
+        'format': args.format,
+        'normalize': args.normalize,
+        'loudness': args.loudness,
+        'trim_silence': args.trim_silence,
+    }
+    summary_items = [{'url': r['url'], 'status': 'error', 'file': None, 'error': None} for r in requests]
+
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.CACHE_DIR) as work_dir:
+        cookie_path = cookie_file(cookie_content)
+        entries = build_info_list(requests, cookie_path, max(args.jobs, settings.METADATA_WORKERS))
+
+        indices = []
+        info_list = []
+        for i, (info, error) in enumerate(entries):
+            if info is None:
+                summary_items[i]['error'] = error
+                log(f"[error] {requests[i]['url']}: {error}")
+            else:
+                indices.append(i)
+                info_list.append(info)
+
+        def report(index, status, fraction, detail):
+            if status == 'done':
+                log(f"[done] {sanitize_filename(info_list[index]['custom_filename'])}")
+            elif status == 'error':
+                log(f"[error] {info_list[index]['url']}: {detail.get('error', '')}")
+
+        results = download_batch(info_list, options, work_dir, cookie_path, TranscodeCache(), report)
+
+        # 出力 (入力順)
+        with default_metrics.timed('zip' if args.zip else 'output', items=len(indices)) as span:
+            if args.zip:
+                writer = StreamingZipWriter(args.zip, store_only=not args.deflate)
+            else:
+                os.makedirs(args.output_dir, exist_ok=True)
+                writer = None
+            try:
+                for i, result in zip(indices, results):
+                    item = summary_items[i]
+                    if not result['path']:
+                        item['error'] = result['error']
+                        continue
+                    filename = os.path.basename(result['path'])
+                    if writer is not None:
+                        item['file'] = writer.add_file(result['path'], filename)
+                    else:
+                        dest = unique_path(args.output_dir, filename)
+                        shutil.move(result['path'], dest)
+                        item['file'] = dest
+                        span['bytes'] += os.path.getsize(dest)
+                    item['status'] = 'ok'
+            finally:
+                if writer is not None:
+                    writer.close()
+                    span['bytes'] = os.path.getsize(args.zip)
+
+    succeeded = sum(1 for item in summary_items if item['status'] == 'ok')
+    summary = {
+        'total': len(summary_items),
+        'succeeded': succeeded,
+        'failed': len(summary_items) - succeeded,
+        'output': os.path.abspath(args.zip or args.output_dir),
+        'elapsed_sec': round(time.time() - started, 3),
+        'items': summary_items,
+        # 段階ごとの処理時間 (秒) ・バイト数
+        'stages': {
+            stage: {key: round(entry[key], 3) for key in ('count', 'errors', 'seconds', 'max_seconds', 'bytes')}
+            for stage, entry in default_metrics.snapshot()['stages'].items()
+        },
+    }
+    json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 0 if succeeded == len(summary_items) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
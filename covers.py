@@ -0,0 +1,96 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+import settings
+from metadata_cache import extract_video_id
+
+
+class _ImageCache:
+    """内容ハッシュをキーにした、合計サイズ上限付きのLRUキャッシュ (プロセス内で共有)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_cache = _ImageCache(settings.COVER_CACHE_MAX_BYTES)
+
+
+def cover_mime(data):
+    """画像データのMIMEタイプ (APICフレーム用)"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'image/jpeg'
+
+
+def _to_jpeg(data, max_dim, quality):
+    with Image.open(io.BytesIO(data)) as im:
+        im.thumbnail((max_dim, max_dim))
+        if im.mode in ('RGBA', 'LA', 'P'):
+            # 透過部分は白背景に合成
+            im = im.convert('RGBA')
+            background = Image.new('RGB', im.size, (255, 255, 255))
+            background.paste(im, mask=im.getchannel('A'))
+            im = background
+        elif im.mode != 'RGB':
+            im = im.convert('RGB')
+        out = io.BytesIO()
+        im.save(out, 'JPEG', quality=quality, optimize=True)
+        return out.getvalue()
+
+
+def _cached(kind, data, max_dim, quality):
+    key = (kind, hashlib.sha256(data).hexdigest(), max_dim, quality)
+    result = _cache.get(key)
+    if result is None:
+        result = _to_jpeg(data, max_dim, quality)
+        _cache.set(key, result)
+    return result
+
+
+def normalize_cover(data, max_dim=settings.COVER_MAX_DIM, quality=settings.COVER_JPEG_QUALITY):
+    """埋め込み用のカバー画像: JPEGに変換し、長辺をmax_dim以下に縮小する (画像でなければ例外)"""
+    try:
+        return _cached('cover', data, max_dim, quality)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"画像を読み込めません: {e}") from e
+
+
+def preview_thumbnail(data, max_dim=settings.PREVIEW_MAX_DIM, quality=settings.PREVIEW_JPEG_QUALITY):
+    """プレビュー表示用の小さなJPEG (読み込めない画像ならNone)"""
+    try:
+        return _cached('preview', data, max_dim, quality)
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+def preview_thumbnail_url(url, thumbnail):
+    """YouTubeのサムネイルはプレビュー用に小さいサイズ (320x180) のURLを使う"""
+    video_id = extract_video_id(url)
+    if video_id:
+        return f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
+    return thumbnail
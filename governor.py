@@ -0,0 +1,146 @@
+import itertools
+import threading
+from contextlib import contextmanager
+
+import settings
+
+# 一時ディスクの見積もり: 1秒あたりのバイト数 (320kbpsの元音声 + 変換後のファイル) と、長さが不明なときの秒数
+ESTIMATED_BYTES_PER_SECOND = 2 * 320_000 // 8
+UNKNOWN_DURATION = 10 * 60
+
+
+def estimate_item_bytes(info):
+    """1件の処理中に一時ディスクへ置かれる量の見積もり"""
+    return int((info.get('duration') or UNKNOWN_DURATION) * ESTIMATED_BYTES_PER_SECOND)
+
+
+class _Ticket:
+    def __init__(self, owner, disk_bytes, seq):
+        self.owner = owner
+        self.disk_bytes = disk_bytes
+        self.seq = seq
+
+
+class ResourceGovernor:
+    """重い処理の実行枠をプロセス内の全セッションで分け合う
+
+    - 処理枠 (slots): 同時に処理するアイテム数の上限。空いた枠は、実行中の枠が最も少ないセッションの
+      待機者へ渡す (大きな一括処理を投入したセッションが、他のセッションを待たせ続けないようにする)
+    - ffmpeg枠 (ffmpeg_slots): 同時に動かす変換の数。CPUコア数に合わせる
+    - 一時ディスクの割り当て (disk_quota): 処理中のアイテムが使う見込みのバイト数の合計を上限以内に抑える
+    """
+
+    def __init__(self, slots=settings.GOVERNOR_SLOTS, ffmpeg_slots=settings.GOVERNOR_FFMPEG_SLOTS,
+                 disk_quota=settings.GOVERNOR_DISK_QUOTA):
+        self.slots = slots
+        self.disk_quota = disk_quota
+        self._ffmpeg = threading.BoundedSemaphore(ffmpeg_slots)
+        self._cond = threading.Condition()
+        self._active = {}
+        self._running = 0
+        self._disk_used = 0
+        self._waiting = []
+        self._last_grant = {}
+        self._seq = itertools.count()
+        self._grants = itertools.count()
+
+    def _order(self):
+        # 順番: (そのセッションの実行中の件数 + 同じセッションで先に待っている件数,
+        #        そのセッションが最後に枠を受け取った順 (受け取っていなければ最優先), 到着順)
+        # 負荷が同じなら、しばらく枠を受け取っていないセッションが先になり、各セッションへ交互に枠が渡る
+        queued = {}
+        keys = []
+        for ticket in self._waiting:
+            ahead = queued.get(ticket.owner, 0)
+            queued[ticket.owner] = ahead + 1
+            load = self._active.get(ticket.owner, 0) + ahead
+            keys.append(((load, self._last_grant.get(ticket.owner, -1), ticket.seq), ticket))
+        return [ticket for _, ticket in sorted(keys, key=lambda pair: pair[0])]
+
+    def _position(self, ticket):
+        # ロック取得済みの状態で呼ぶこと。0なら次に枠を受け取る
+        return self._order().index(ticket)
+
+    def _can_start(self, ticket):
+        # ロック取得済みの状態で呼ぶこと。先頭以外は追い越さない (大きなアイテムが待たされ続けないように)
+        if self._running >= self.slots or self._order()[0] is not ticket:
+            return False
+        return self._running == 0 or self._disk_used + ticket.disk_bytes <= self.disk_quota
+
+    def _wait_for_turn(self, ticket, on_wait):
+        # 順番が来たら枠を受け取って戻る。on_wait はロックの外で呼ぶ (UIの更新で他の待機者を止めないように)
+        last_position = None
+        while True:
+            with self._cond:
+                if self._can_start(ticket):
+                    self._waiting.remove(ticket)
+                    self._last_grant[ticket.owner] = next(self._grants)
+                    self._active[ticket.owner] = self._active.get(ticket.owner, 0) + 1
+                    self._running += 1
+                    self._disk_used += ticket.disk_bytes
+                    # 先頭が入れ替わったので、次の待機者の判定をやり直させる
+                    self._cond.notify_all()
+                    return
+                position = self._position(ticket)
+                if on_wait is None or position == last_position:
+                    self._cond.wait()
+                    continue
+            # ロックを離している間に状態が変わっても、次の周回で判定し直すので通知は取りこぼさない
+            on_wait(position)
+            last_position = position
+
+    def _forget(self, owner):
+        # ロック取得済みの状態で呼ぶこと。実行中・待機中のものがなくなったセッションの記録は残さない
+        if owner not in self._active and not any(waiting.owner == owner for waiting in self._waiting):
+            self._last_grant.pop(owner, None)
+
+    @contextmanager
+    def slot(self, owner, disk_bytes=0, on_wait=None):
+        """処理枠を1つ確保する (空くまで待つ)
+
+        on_wait(position) は待っている間、順番 (0始まり、前に何件あるか) が変わるたびに呼ばれる。
+        """
+        with self._cond:
+            ticket = _Ticket(owner, disk_bytes, next(self._seq))
+            self._waiting.append(ticket)
+        try:
+            self._wait_for_turn(ticket, on_wait)
+        except BaseException:
+            # 待っている間に中断された (on_wait の例外・Streamlitの再実行など) ら順番から外す。
+            # 残したままだと先頭から動かない待機者になり、全セッションの処理が止まる
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._forget(owner)
+                self._cond.notify_all()
+            raise
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[owner] -= 1
+                if not self._active[owner]:
+                    del self._active[owner]
+                    self._forget(owner)
+                self._running -= 1
+                self._disk_used -= ticket.disk_bytes
+                self._cond.notify_all()
+
+    @contextmanager
+    def ffmpeg_slot(self):
+        """変換 (ffmpeg) の実行枠を1つ確保する"""
+        with self._ffmpeg:
+            yield
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'running': self._running,
+                'waiting': len(self._waiting),
+                'sessions': len(self._active),
+                'disk_used': self._disk_used,
+            }
+
+
+# プロセス全体で共有する割り当て
+default_governor = ResourceGovernor()
@@ -0,0 +1,265 @@
+import copy
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from metrics import default_metrics
+from pipeline import cookie_file, download_batch, output_mime, sanitize_filename
+from workspace import DONE as ITEM_DONE, Workspace, batch_id, cleanup_workspaces
+from zip_stream import StreamingZipWriter
+
+# ジョブの状態
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'  # 実行中にプロセスが終了した
+TERMINAL_STATUSES = (DONE, FAILED, INTERRUPTED)
+
+# アイテムの状態のうち、終了を表すもの
+ITEM_TERMINAL_STATUSES = ('done', 'error')
+
+
+class JobManager:
+    """ダウンロードをスクリプトスレッドの外で実行するバックグラウンドジョブ管理
+
+    ジョブはIDで識別し、状態はSQLiteに保存する (再接続・再実行後も参照できる)。
+    実行中の細かな進捗はメモリ上だけで更新し、アイテムの完了時とジョブの終了時に保存する。
+    UIは get() でスナップショットを取得してポーリングする。
+    """
+
+    def __init__(self, artifact_store, transcode_cache, path=None, workers=settings.JOB_WORKERS):
+        self.artifact_store = artifact_store
+        self.transcode_cache = transcode_cache
+        self.path = path or os.path.join(settings.CACHE_DIR, "jobs.sqlite3")
+        self._lock = threading.Lock()
+        self._live = {}
+        self._active_batches = set()
+        self._last_sweep = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        # 前回のプロセスで終わらなかったジョブは中断扱いにする
+        self._conn.execute(
+            "UPDATE jobs SET status = ? WHERE status IN (?, ?)", (INTERRUPTED, QUEUED, RUNNING)
+        )
+        self._conn.commit()
+        self.sweep()
+
+    def sweep(self, interval=0):
+        """保持期間を過ぎたジョブと作業ディレクトリを削除する (前回から interval 秒以内なら何もしない)
+
+        起動時のほか、ジョブの終了ごとに呼ぶ。実行中の一括処理の作業ディレクトリは残す。
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep < interval:
+                return
+            self._last_sweep = now
+            self._conn.execute(
+                "DELETE FROM jobs WHERE updated_at < ?", (time.time() - settings.JOB_RETENTION,)
+            )
+            self._conn.commit()
+            active = set(self._active_batches)
+        cleanup_workspaces(keep=active)
+
+    def submit(self, owner, info_list, options, cookie_content=None):
+        """ジョブを登録してワーカーへ投入し、ジョブIDを返す"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        state = {
+            'job_id': job_id,
+            'owner': owner,
+            'status': QUEUED,
+            'created_at': now,
+            'items': [
+                {
+                    'filename': sanitize_filename(info['custom_filename']),
+                    'status': 'queued',
+                    'fraction': 0.0,
+                    'detail': {},
+                }
+                for info in info_list
+            ],
+            'results': [],
+            'zip_artifact': None,
+            'error': None,
+        }
+        with self._lock:
+            self._live[job_id] = state
+            self._persist(job_id)
+        self._executor.submit(self._run, job_id, info_list, options, cookie_content)
+        return job_id
+
+    def get(self, job_id):
+        """ジョブのスナップショット (コピー) を返す。見つからなければNone"""
+        with self._lock:
+            state = self._live.get(job_id)
+            if state is not None:
+                return copy.deepcopy(state)
+            row = self._conn.execute("SELECT status, state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, state_json = row
+        state = json.loads(state_json)
+        state['status'] = status
+        return state
+
+    def _persist(self, job_id):
+        # ロック取得済みの状態で呼ぶこと
+        state = self._live[job_id]
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, owner, status, state, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, state['owner'], state['status'], json.dumps(state, ensure_ascii=False),
+             state['created_at'], time.time()),
+        )
+        self._conn.commit()
+
+    def _report(self, job_id, index, status, fraction, detail):
+        with self._lock:
+            item = self._live[job_id]['items'][index]
+            item['status'] = status
+            item['fraction'] = fraction
+            item['detail'] = detail
+            if status in ITEM_TERMINAL_STATUSES:
+                self._persist(job_id)
+
+    def _set_status(self, job_id, status, **fields):
+        with self._lock:
+            state = self._live[job_id]
+            state['status'] = status
+            state.update(fields)
+            self._persist(job_id)
+            if status in TERMINAL_STATUSES:
+                del self._live[job_id]
+
+    def _store_results(self, results, work_dir, owner, workspace):
+        # 完成したファイルはアーティファクトストアへ登録し、ZIPもディスク上に逐次書き出す
+        # (結果とZIPは元の入力順を維持する)。作業ディレクトリのファイルは再投入時のために残す
+        downloaded_data = []
+        zip_artifact = None
+        zip_path = os.path.join(work_dir, "audio_archive.zip")
+        with default_metrics.timed('zip', items=len(results)) as span:
+            with StreamingZipWriter(zip_path, store_only=settings.ZIP_STORE_ONLY) as zw:
+                for idx, result in enumerate(results):
+                    if not result['path']:
+                        continue
+                    filename = zw.add_file(result['path'], os.path.basename(result['path']))
+                    staged_path = os.path.join(work_dir, f"{idx}_{filename}")
+                    _link_or_copy(result['path'], staged_path)
+                    digest = self.artifact_store.put_file(owner, staged_path)
+                    workspace.set_state(idx, ITEM_DONE, artifact=digest)
+                    downloaded_data.append({"index": idx, "filename": filename, "artifact": digest, "mime": output_mime(filename)})
+            span['bytes'] = os.path.getsize(zip_path)
+
+        if downloaded_data:
+            zip_artifact = self.artifact_store.put_file(owner, zip_path)
+        return downloaded_data, zip_artifact
+
+    def _acquire_workspace(self, info_list, options):
+        # 同じ一括処理の再投入は同じ作業ディレクトリを使う (同時実行中なら使い捨ての別ディレクトリ)
+        name = batch_id(info_list, options)
+        disposable = False
+        with self._lock:
+            if name in self._active_batches:
+                name = f"{name}-{uuid.uuid4().hex[:8]}"
+                disposable = True
+            self._active_batches.add(name)
+        try:
+            workspace = Workspace(os.path.join(settings.WORKSPACE_DIR, name))
+        except BaseException:
+            with self._lock:
+                self._active_batches.discard(name)
+            raise
+        return name, workspace, disposable
+
+    def _run(self, job_id, info_list, options, cookie_content):
+        name = None
+        try:
+            self._set_status(job_id, RUNNING)
+            owner = self._live[job_id]['owner']
+            name, workspace, disposable = self._acquire_workspace(info_list, options)
+            with self.artifact_store.staging_dir() as work_dir:
+                cookie_path = cookie_file(cookie_content)
+                results = download_batch(
+                    info_list, options, work_dir, cookie_path, self.transcode_cache,
+                    lambda *args: self._report(job_id, *args),
+                    workspace,
+                    owner,
+                )
+                all_done = all(result['path'] for result in results)
+                results, zip_artifact = self._store_results(results, work_dir, owner, workspace)
+            # すべて完成したら作業ディレクトリは不要 (失敗したアイテムがあれば再投入に備えて残す)
+            if all_done or disposable:
+                workspace.remove()
+        except Exception as e:
+            traceback.print_exc()
+            self._set_status(job_id, FAILED, error=str(e))
+            return
+        finally:
+            with self._lock:
+                self._active_batches.discard(name)
+            self.sweep(settings.JOB_SWEEP_INTERVAL)
+        self._set_status(job_id, DONE, results=results, zip_artifact=zip_artifact)
+
+
+def batch_progress(items):
+    """ジョブのアイテム一覧から一括処理全体の進捗をまとめる
+
+    戻り値は {'fraction', 'finished', 'total', 'running', 'queue_position', 'speed', 'eta'}。
+    running は処理中 (ダウンロード・変換中) の件数、queue_position は実行枠を待っているアイテムのうち
+    最も前にあるものの順番 (待っていなければNone)。speed は実行中のダウンロードの合計 (バイト/秒)。
+    eta は残りのダウンロード量を合計速度で割った秒数で、サイズが分からない待機中のアイテムは
+    サイズが分かっているアイテムの平均で見積もる (見積もれないときはNone)。変換にかかる時間は含まない。
+    """
+    total = len(items)
+    finished = sum(1 for item in items if item['status'] in ITEM_TERMINAL_STATUSES)
+    fraction = sum(
+        1.0 if item['status'] in ITEM_TERMINAL_STATUSES else item['fraction'] for item in items
+    ) / total if total else 1.0
+
+    sizes = [item['detail']['total_bytes'] for item in items if item['detail'].get('total_bytes')]
+    average_size = sum(sizes) / len(sizes) if sizes else None
+    speed = sum(item['detail'].get('speed') or 0 for item in items if item['status'] == 'downloading')
+    running = sum(1 for item in items if item['status'] in ('downloading', 'converting'))
+    positions = [item['detail']['position'] for item in items
+                 if item['status'] == 'queued' and item['detail'].get('position') is not None]
+
+    remaining = 0
+    for item in items:
+        if item['status'] == 'queued':
+            remaining += average_size or 0
+        elif item['status'] == 'downloading':
+            size = item['detail'].get('total_bytes') or average_size or 0
+            remaining += max(size - (item['detail'].get('downloaded_bytes') or 0), 0)
+    eta = remaining / speed if speed and average_size else None
+    return {
+        'fraction': fraction, 'finished': finished, 'total': total, 'running': running,
+        'queue_position': min(positions) if positions else None, 'speed': speed, 'eta': eta,
+    }
+
+
+def _link_or_copy(src, dest):
+    """同じファイルシステムならハードリンク (コピー不要)、できなければコピー"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import settings
+
+_VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_YOUTUBE_HOSTS = ('youtube.com', 'youtube-nocookie.com')
+_COLLECTION_PATHS = ('/playlist', '/@', '/channel/', '/c/', '/user/')
+
+# キャッシュに保存するフィールド (アプリで実際に使うものだけ)
+CACHED_FIELDS = ('title', 'uploader', 'thumbnail', 'duration')
+
+
+def host_matches(host, domains):
+    """host が domains のいずれかそのものか、そのサブドメインか (notyoutube.com 等は含めない)"""
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def extract_video_id(url):
+    """YouTubeのURLから動画IDを取り出す (該当しなければNone)"""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+
+    candidate = None
+    if host == 'youtu.be':
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif host_matches(host, _YOUTUBE_HOSTS):
+        if parsed.path == '/watch':
+            candidate = parse_qs(parsed.query).get('v', [None])[0]
+        else:
+            parts = parsed.path.strip('/').split('/')
+            if len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+                candidate = parts[1]
+
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def is_collection_url(url):
+    """YouTubeのプレイリスト・チャンネルのURLか (list= 付きの動画URLも含む)"""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return False
+    host = (parsed.hostname or '').lower()
+    if host != 'youtu.be' and not host_matches(host, _YOUTUBE_HOSTS):
+        return False
+    if parse_qs(parsed.query).get('list'):
+        return True
+    return host != 'youtu.be' and parsed.path.startswith(_COLLECTION_PATHS)
+
+
+def canonical_url(url):
+    """同じ動画を指すURL (youtu.be / m.youtube.com / 再生位置付き等) を1つの形にそろえる"""
+    video_id = extract_video_id(url)
+    if video_id:
+        return f"https://www.youtube.com/watch?v={video_id}"
+    return url.strip()
+
+
+def dedupe_urls(urls):
+    """URLを正規化して重複を除く
+
+    (正規化したURLのリスト, 除外した重複の (入力されたURL, 先に入力された同じ動画のURL) のリスト) を返す。
+    """
+    first_seen = {}
+    unique = []
+    duplicates = []
+    for url in urls:
+        key = cache_key(url)
+        if key in first_seen:
+            duplicates.append((url.strip(), first_seen[key]))
+            continue
+        first_seen[key] = url.strip()
+        unique.append(canonical_url(url))
+    return unique, duplicates
+
+
+def cache_key(url):
+    """キャッシュキー: YouTubeなら動画ID、それ以外はURLそのもの"""
+    video_id = extract_video_id(url)
+    if video_id:
+        return f"youtube:{video_id}"
+    return f"url:{url.strip()}"
+
+
+class MetadataCache:
+    """SQLiteに保存する、TTLとLRU削除付きのメタデータキャッシュ"""
+
+    def __init__(self, path=None, ttl=settings.METADATA_CACHE_TTL, max_entries=settings.METADATA_CACHE_MAX_ENTRIES):
+        self.path = path or os.path.join(settings.CACHE_DIR, "metadata.sqlite3")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed_at)")
+        self._conn.commit()
+
+    def get(self, url):
+        key = cache_key(url)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM metadata WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE metadata SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, url, info):
+        slim = {field: info.get(field) for field in CACHED_FIELDS}
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (cache_key(url), json.dumps(slim, ensure_ascii=False), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+        return slim
+
+    def _evict(self):
+        # 期限切れを削除し、上限を超えた分は最終アクセスの古い順に削除
+        self._conn.execute("DELETE FROM metadata WHERE created_at < ?", (time.time() - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM metadata WHERE key IN (SELECT key FROM metadata ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
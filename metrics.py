@@ -0,0 +1,130 @@
+import http.server
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import settings
+
+# 処理時間のヒストグラムの区切り (秒)
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _new_stage():
+    return {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0, 'buckets': [0] * len(BUCKETS)}
+
+
+class Metrics:
+    """パイプラインの段階ごとの処理時間・バイト数・エラー数の集計 (プロセス内の全セッションで共有)
+
+    record() した値はメモリ上で集計し、snapshot() / render_prometheus() で参照する。
+    log_path を指定すると、1件ごとの記録をJSON Linesで追記する。
+    """
+
+    def __init__(self, log_path=settings.METRICS_LOG):
+        self.log_path = log_path
+        self._stages = {}
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, nbytes=0, error=None, **fields):
+        """1回分の処理時間を記録する (error を渡すと失敗として数える)"""
+        with self._lock:
+            entry = self._stages.setdefault(stage, _new_stage())
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['bytes'] += nbytes
+            if error is not None:
+                entry['errors'] += 1
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+            if self.log_path:
+                line = {'ts': time.time(), 'stage': stage, 'seconds': round(seconds, 6), 'bytes': nbytes,
+                        'ok': error is None, **fields}
+                if error is not None:
+                    line['error'] = str(error)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def timed(self, stage, **fields):
+        """with内の処理時間を stage として記録する。yieldした辞書の 'bytes' に処理したバイト数を入れられる"""
+        span = {'bytes': 0}
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            self.record(stage, time.perf_counter() - started, span['bytes'], error=e, **fields)
+            raise
+        self.record(stage, time.perf_counter() - started, span['bytes'], **fields)
+
+    def count(self, event, n=1):
+        """キャッシュヒットなど、時間を伴わない出来事の回数を数える"""
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {stage: dict(entry, buckets=list(entry['buckets'])) for stage, entry in self._stages.items()},
+                'events': dict(self._events),
+            }
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式で出力する"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP audio_dl_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE audio_dl_stage_seconds histogram",
+        ]
+        for stage, entry in sorted(snapshot['stages'].items()):
+            for bound, count in zip(BUCKETS, entry['buckets']):
+                lines.append(f'audio_dl_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'audio_dl_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'audio_dl_stage_seconds_sum{{stage="{stage}"}} {entry["seconds"]:.6f}')
+            lines.append(f'audio_dl_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        for name, key, help_text in (
+            ('audio_dl_stage_errors_total', 'errors', "Failed runs of each pipeline stage."),
+            ('audio_dl_stage_bytes_total', 'bytes', "Bytes processed by each pipeline stage."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, entry in sorted(snapshot['stages'].items()):
+                lines.append(f'{name}{{stage="{stage}"}} {entry[key]}')
+        lines.append("# HELP audio_dl_events_total Pipeline events such as cache hits.")
+        lines.append("# TYPE audio_dl_events_total counter")
+        for event, count in sorted(snapshot['events'].items()):
+            lines.append(f'audio_dl_events_total{{event="{event}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port=settings.METRICS_PORT, host=settings.METRICS_HOST, metrics=None):
+    """GET /metrics でPrometheus形式のテキストを返すHTTPサーバーをバックグラウンドで起動する"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics or default_metrics})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
+
+
+# プロセス全体で共有する集計
+default_metrics = Metrics()
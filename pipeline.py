@@ -0,0 +1,586 @@
+import atexit
+import functools
+import hashlib
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import settings
+from audio_filters import filter_spec, render, variant_key
+from covers import normalize_cover
+from governor import default_governor, estimate_item_bytes
+from metrics import default_metrics
+from metadata_cache import extract_video_id, is_collection_url
+from scheduler import default_scheduler
+from tagging import apply_tags
+from transcode_cache import AUDIO_NAME, COVER_NAME, transcode_key
+from workspace import DOWNLOADING, PENDING, TAGGED, TRANSCODING, item_fingerprint
+from ydl_pool import default_pool
+
+# ダウンロード処理の本体 (Streamlitに依存しない)。
+# UIスレッド以外 (ジョブのワーカー等) から呼ばれる前提で、進捗はコールバックで通知する。
+
+
+# ── 共通関数: ファイル名サニタイズ ──
+def sanitize_filename(name):
+    """ファイル名に使えない文字を除去"""
+    return re.sub(r'[\\/*?:"<>|]', "", name)
+
+
+# ── 出力形式 ──
+# passthrough: 変換せずに使える元ストリームの条件 (yt-dlpのフォーマットフィルタ)。
+# 元ストリームのコーデックが出力形式と同じなら、FFmpegExtractAudio は再エンコードせずコンテナの詰め替えだけで済む。
+OUTPUT_FORMATS = {
+    'mp3': {'ext': 'mp3', 'mime': 'audio/mpeg', 'passthrough': ['[acodec=mp3]']},
+    'm4a': {'ext': 'm4a', 'mime': 'audio/mp4', 'passthrough': ['[ext=m4a]', '[acodec^=mp4a]']},
+    'opus': {'ext': 'opus', 'mime': 'audio/ogg', 'passthrough': ['[acodec=opus]']},
+}
+
+
+def audio_format_selector(output_format, quality):
+    """変換不要な音声ストリームを優先するフォーマット指定を作る
+
+    ビットレート指定時は、それ以下のストリームだけを変換不要の候補にする
+    (コーデックが一致すると指定ビットレートへの再エンコードは行われないため)。
+    見つからなければ従来どおり最良の音声を選び、変換する。
+    """
+    limit = f"[abr<={quality}]" if quality != '0' else ''
+    candidates = [f"bestaudio{f}{limit}" for f in OUTPUT_FORMATS[output_format]['passthrough']]
+    return '/'.join(candidates + ['bestaudio/best'])
+
+
+def output_mime(path):
+    """出力ファイルのMIMEタイプ (拡張子から)"""
+    ext = os.path.splitext(path)[1].lstrip('.').lower()
+    for spec in OUTPUT_FORMATS.values():
+        if spec['ext'] == ext:
+            return spec['mime']
+    return 'application/octet-stream'
+
+
+# ── 共通関数: Cookieファイルの書き出し ──
+# 同じ内容のCookieはプロセスで1回だけファイルに書き出し、全リクエストで共有する (終了時に削除)
+_cookie_lock = threading.Lock()
+_cookie_files = {}
+_cookie_dir = None
+
+
+def cookie_file(cookie_content):
+    """Cookieの内容を書き出したファイルのパスを返す (空ならNone)"""
+    global _cookie_dir
+    if not cookie_content or not cookie_content.strip(): # 空でない場合のみ作成
+        return None
+    digest = hashlib.sha256(cookie_content.encode('utf-8')).hexdigest()
+    with _cookie_lock:
+        path = _cookie_files.get(digest)
+        if path is None or not os.path.exists(path):
+            if _cookie_dir is None:
+                _cookie_dir = tempfile.mkdtemp(prefix="audio_dl_cookies_")
+                atexit.register(shutil.rmtree, _cookie_dir, True)
+            path = os.path.join(_cookie_dir, f"{digest[:16]}.txt")
+            # 本人だけが読み書きできるファイルとして作成
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(cookie_content)
+            _cookie_files[digest] = path
+    return path
+
+
+# ── メタデータ取得 ──
+# 【修正点】オプションを強化してエラーを回避
+METADATA_YDL_OPTS = {
+    'quiet': True,
+    'extract_flat': False,
+    'skip_download': True,
+    'format': 'best',        # 形式を指定して検索を安定化
+    'noplaylist': True,      # プレイリストURLでも単体動画として処理
+    'check_formats': False,  # メタデータ取得時は厳密なフォーマットチェックをスキップ
+    'ignoreerrors': False,   # 失敗は例外で受け取り、再試行するかはスケジューラが判断する
+}
+
+
+def fetch_metadata(url, ydl_opts, metadata_cache):
+    """1件分のメタデータ取得 (キャッシュ優先、ワーカースレッドで実行)"""
+    cached = metadata_cache.get(url)
+    if cached is not None:
+        default_metrics.count('metadata_cache_hit')
+        return cached
+    def extract():
+        with default_pool.acquire(ydl_opts) as ydl:
+            # download=Falseで情報のみ取得
+            return ydl.extract_info(url, download=False)
+
+    with default_metrics.timed('metadata', url=url):
+        info = default_scheduler.call(url, extract)
+    if not info:
+        return None
+    return metadata_cache.set(url, info)
+
+
+def resolve_metadata(urls, cookie_path, metadata_cache, workers=settings.METADATA_WORKERS):
+    """URLごとのメタデータを並列に取得し、入力順の (メタデータ or None, エラー文字列 or None) のリストを返す"""
+    ydl_opts = dict(METADATA_YDL_OPTS)
+    if cookie_path: ydl_opts['cookiefile'] = cookie_path
+
+    # YoutubeDLはスレッドセーフではないため、ワーカーごとにプールから別々のインスタンスを借りて並列解析
+    with default_metrics.timed('metadata_batch', items=len(urls)), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_metadata, url, dict(ydl_opts), metadata_cache) for url in urls]
+
+    resolved = []
+    for future in futures:
+        try:
+            resolved.append((future.result(), None))
+        except Exception as e:
+            resolved.append((None, str(e)))
+    return resolved
+
+
+def warm_up(cookie_path=None):
+    """最初のリクエストの前に重い初期化を済ませておく
+
+    yt-dlpを読み込み、メタデータ解析と同じ設定のYoutubeDLをプールに1つ用意して
+    YouTubeの抽出器を初期化する。ffmpegのバージョン表記 (見つからなければNone) を返す。
+    """
+    ydl_opts = dict(METADATA_YDL_OPTS)
+    if cookie_path: ydl_opts['cookiefile'] = cookie_path
+    with default_metrics.timed('warmup'):
+        with default_pool.acquire(ydl_opts) as ydl:
+            ydl.get_info_extractor('Youtube')
+        try:
+            result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout.splitlines()[0]
+
+
+def make_info(url, meta):
+    """メタデータから、編集可能な項目 (custom_*) を持つアイテムを作る"""
+    return {
+        'title': meta.get('title') or 'Unknown',
+        'uploader': meta.get('uploader') or 'Unknown',
+        'thumbnail': meta.get('thumbnail'),
+        'duration': meta.get('duration'),
+        'url': url,
+        'custom_filename': sanitize_filename(meta.get('title') or 'audio'),
+        'custom_title': meta.get('title') or 'Unknown',
+        'custom_artist': meta.get('uploader') or 'Unknown',
+        'custom_album': '',
+        'custom_start': '',
+        'custom_end': '',
+        'custom_cover_bytes': None
+    }
+
+
+# ── プレイリスト・チャンネルの展開 ──
+PLAYLIST_YDL_OPTS = {
+    'quiet': True,
+    'skip_download': True,
+    'extract_flat': 'in_playlist',  # 各動画は解析せず、一覧に含まれる情報だけを使う
+}
+
+# 入れ子の一覧 (チャンネルのタブ等) をたどる深さの上限
+_MAX_NESTING = 2
+
+
+def _flat_meta(entry):
+    """一覧のエントリからプレビュー用のメタデータを作る (CACHED_FIELDSと同じ形)"""
+    thumbnails = entry.get('thumbnails') or []
+    return {
+        'title': entry.get('title'),
+        'uploader': entry.get('uploader') or entry.get('channel'),
+        'thumbnail': entry.get('thumbnail') or (thumbnails[-1].get('url') if thumbnails else None),
+        'duration': int(entry['duration']) if entry.get('duration') else None,
+    }
+
+
+def _entry_url(entry):
+    url = entry.get('webpage_url') or entry.get('url')
+    if url and '://' not in url and entry.get('ie_key') == 'Youtube':
+        url = f"https://www.youtube.com/watch?v={url}"
+    return url
+
+
+def _iter_entries(url, entries):
+    """一覧のエントリを順に返す (続きの取得はページ単位でスケジューラを通す)"""
+    from yt_dlp.utils import PagedList
+
+    size = settings.PLAYLIST_PAGE_SIZE
+    if isinstance(entries, PagedList):
+        # 遅延取得のリスト (PagedList) はスライス単位で読み進める。失敗したページはそのページから再試行する
+        def fetch(start, pagecount):
+            # 取得に失敗すると、そのページより後はないものとして記録されるため、試行のたびに戻す
+            entries._pagecount = pagecount
+            return entries.getslice(start, start + size)
+
+        start = 0
+        while True:
+            page = default_scheduler.call(url, functools.partial(fetch, start, entries._pagecount))
+            if not page:
+                return
+            yield from page
+            start += len(page)
+    elif isinstance(entries, (list, tuple)) or entries is None:
+        yield from entries or []
+    else:
+        # ジェネレーター等も読み進めるときに続きを取得する。途中で失敗すると続きから読めないため再試行はしない
+        iterator = iter(entries)
+        while True:
+            page = default_scheduler.call(url, lambda: list(itertools.islice(iterator, size)), max_attempts=1)
+            if not page:
+                return
+            yield from page
+
+
+def _iter_flat_entries(ydl, source_url, result, depth=0):
+    if not result:
+        return
+    kind = result.get('_type', 'video')
+    if kind in ('playlist', 'multi_video'):
+        for entry in _iter_entries(source_url, result.get('entries')):
+            yield from _iter_flat_entries(ydl, source_url, entry, depth + 1)
+        return
+
+    url = _entry_url(result)
+    if not url:
+        return
+    if kind in ('url', 'url_transparent') and is_collection_url(url) and not extract_video_id(url):
+        # チャンネルのタブ等、一覧の中の一覧
+        if depth < _MAX_NESTING:
+            nested = default_scheduler.call(url, lambda: ydl.extract_info(url, download=False, process=False))
+            yield from _iter_flat_entries(ydl, url, nested, depth + 1)
+        return
+    yield url, _flat_meta(result)
+
+
+def iter_playlist_pages(url, cookie_path=None, page_size=settings.PLAYLIST_PAGE_SIZE,
+                        max_entries=settings.PLAYLIST_MAX_ENTRIES):
+    """プレイリスト・チャンネルを遅延展開し、(URL, メタデータ) のリストをpage_size件ずつ返す
+
+    extract_flat で一覧の情報だけを取得するため動画ごとの解析は行わず、
+    一覧の続きは読み進めた分だけ取得される。
+    """
+    ydl_opts = dict(PLAYLIST_YDL_OPTS)
+    if cookie_path: ydl_opts['cookiefile'] = cookie_path
+
+    with default_pool.acquire(ydl_opts) as ydl:
+        result = default_scheduler.call(url, lambda: ydl.extract_info(url, download=False, process=False))
+        page = []
+        for count, entry in enumerate(_iter_flat_entries(ydl, url, result), 1):
+            page.append(entry)
+            if len(page) >= page_size:
+                yield page
+                page = []
+            if count >= max_entries:
+                break
+        if page:
+            yield page
+
+
+# ── 進捗通知用のクラス ──
+# yt-dlpのフックはワーカースレッドから呼ばれる。report(index, status, fraction, detail) へ中継する。
+# アイテム全体の進捗のうちダウンロードに割り当てる割合 (残りは変換・タグ付け)
+DOWNLOAD_SHARE = 0.8
+# 変換中の各段階に入った時点の進捗
+STAGE_FRACTIONS = {'transcoding': DOWNLOAD_SHARE, 'tagging': 0.95}
+
+
+class ProgressHooks:
+    """yt-dlpの進捗コールバックを report(index, status, fraction, detail) に変換する
+
+    fraction はアイテム全体の進捗で、ダウンロード中はバイト数から計算する。
+    同じ状態の更新は interval 秒に1回までにまとめ、状態や段階が変わったときは必ず通知する。
+    """
+
+    def __init__(self, index, report, interval=settings.PROGRESS_INTERVAL):
+        self.index = index
+        self.report = report
+        self.interval = interval
+        self._last = (None, 0.0)
+        self._stage = None
+
+    def _emit(self, status, fraction, detail, force=False):
+        now = time.monotonic()
+        last_status, last_time = self._last
+        if not force and status == last_status and now - last_time < self.interval:
+            return
+        self._last = (status, now)
+        self.report(self.index, status, fraction, detail)
+
+    def started(self):
+        """実行枠を受け取って処理を始めたことを通知する"""
+        self._emit('downloading', 0.0, {}, force=True)
+
+    def hook(self, d):
+        if d['status'] == 'downloading':
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            fraction = min(downloaded / total, 1.0) if total else 0.0
+            self._emit('downloading', fraction * DOWNLOAD_SHARE, {
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'speed': d.get('speed'),
+                'eta': d.get('eta'),
+            })
+
+        elif d['status'] == 'finished':
+            self.stage('transcoding')
+
+    def postprocessor_hook(self, d):
+        # サムネイルの変換などは対象外。音声の変換の開始だけを段階として通知する
+        if d['postprocessor'] == 'ExtractAudio' and d['status'] == 'started':
+            self.stage('transcoding')
+
+    def stage(self, name):
+        """変換中の段階 ('transcoding' / 'tagging') を通知する"""
+        if self._last[0] == 'converting' and self._stage == name:
+            return
+        self._stage = name
+        self._emit('converting', STAGE_FRACTIONS[name], {'stage': name}, force=True)
+
+    def retry(self, attempt, delay, error):
+        # スケジューラが再試行を待っている間の表示
+        self._emit('downloading', 0.0, {
+            'retry': f"再試行 {attempt}回目: {delay:.0f}秒後 ({error})",
+        }, force=True)
+
+
+# 計測する後処理と、その段階名
+_TIMED_POSTPROCESSORS = {'ExtractAudio': 'transcode', 'ThumbnailsConvertor': 'thumbnail'}
+
+
+class _StageTimer:
+    """1回のyt-dlp呼び出しの中で、ダウンロードと後処理 (変換・サムネイル) の時間を分けて計測する"""
+
+    def __init__(self):
+        self.downloaded_bytes = 0
+        self.postprocessor_seconds = {}
+        self._started = {}
+
+    def progress_hook(self, d):
+        if d['status'] == 'finished':
+            self.downloaded_bytes += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+
+    def postprocessor_hook(self, d):
+        name = d['postprocessor']
+        if d['status'] == 'started':
+            self._started[name] = time.perf_counter()
+        elif d['status'] == 'finished' and name in self._started:
+            elapsed = time.perf_counter() - self._started.pop(name)
+            self.postprocessor_seconds[name] = self.postprocessor_seconds.get(name, 0.0) + elapsed
+
+    def record(self, url, elapsed, error=None):
+        # ダウンロードの時間は、呼び出し全体 (再試行の待ち時間を含む) から後処理の時間を引いたもの
+        for name, stage in _TIMED_POSTPROCESSORS.items():
+            if name in self.postprocessor_seconds:
+                nbytes = self.downloaded_bytes if stage == 'transcode' else 0
+                default_metrics.record(stage, self.postprocessor_seconds[name], nbytes, url=url)
+        download_seconds = max(elapsed - sum(self.postprocessor_seconds.values()), 0.0)
+        default_metrics.record('download', download_seconds, self.downloaded_bytes, error=error, url=url)
+
+
+class _FfmpegGate:
+    """音声の変換 (ffmpeg) が始まる直前にffmpeg枠を確保し、終わったら返す"""
+
+    def __init__(self):
+        self._slot = None
+
+    def postprocessor_hook(self, d):
+        if d['postprocessor'] != 'ExtractAudio':
+            return
+        if d['status'] == 'started' and self._slot is None:
+            self._slot = default_governor.ffmpeg_slot()
+            self._slot.__enter__()
+        elif d['status'] == 'finished':
+            self.release()
+
+    def release(self):
+        # 変換が例外で終わると 'finished' が来ないため、呼び出し側でも必ず呼ぶ
+        if self._slot is not None:
+            self._slot.__exit__(None, None, None)
+            self._slot = None
+
+
+def download_item(info, out_dir, options, cookie_path, transcode_cache, hooks, download_dir=None):
+    """1件分のダウンロード・変換・タグ付けを行い、完成したファイルのパスを返す
+
+    options は {'quality': '0'|'192'|..., 'embed_thumb': bool, 'format': 'mp3'|'m4a'|'opus'} と、
+    任意の加工 {'normalize': bool, 'loudness': 目標LUFS, 'trim_silence': bool} (audio_filters.filter_spec を参照)。
+    info の custom_start / custom_end を指定すると、その範囲だけを切り出す。
+    download_dir を渡すと、yt-dlpはそこへダウンロードする (途中ファイルが残り、次回は続きから再開できる)。
+    """
+    final_filename = sanitize_filename(info['custom_filename'])
+    custom_cover = info.get('custom_cover_bytes')
+    quality_val = options['quality']
+    output_format = options.get('format', 'mp3')
+    spec = filter_spec(info, options)
+
+    produced = []
+
+    # 加工する場合は、ダウンロードした元の音声から加工と変換を1回のffmpeg実行で行う
+    def transcode_filtered(work_dir):
+        source = next(
+            os.path.join(work_dir, name) for name in os.listdir(work_dir)
+            if os.path.splitext(name)[0] == AUDIO_NAME and name != COVER_NAME
+        )
+        ext = OUTPUT_FORMATS[output_format]['ext']
+        temp_path = os.path.join(work_dir, f"{AUDIO_NAME}.temp.{ext}")
+        hooks.stage('transcoding')
+        with default_governor.ffmpeg_slot(), default_metrics.timed('transcode', url=info['url']) as span:
+            span['bytes'] = os.path.getsize(source)
+            render(source, temp_path, output_format, quality_val, spec)
+        os.unlink(source)
+        os.replace(temp_path, os.path.join(work_dir, f"{AUDIO_NAME}.{ext}"))
+
+    # 変換結果 (タグなし音声 + サムネイル) は動画ID・コーデック・ビットレート・加工内容の単位で共有キャッシュする
+    def produce(work_dir):
+        produced.append(True)
+        target_dir = download_dir or work_dir
+        timer = _StageTimer()
+        ffmpeg_gate = _FfmpegGate()
+        ydl_opts = {
+            'outtmpl': f'{target_dir}/{AUDIO_NAME}.%(ext)s',
+            'continuedl': True,
+            'quiet': True,
+            'noprogress': True,
+            'progress_hooks': [hooks.hook, timer.progress_hook],
+            'postprocessor_hooks': [hooks.postprocessor_hook, ffmpeg_gate.postprocessor_hook, timer.postprocessor_hook],
+            # 変換不要な形式 → 音質優先で選択 (加工する場合はどのみち再エンコードするので、最良の音声)
+            'format': audio_format_selector(output_format, quality_val) if spec is None else 'bestaudio/best',
+            'noplaylist': True,
+            'writethumbnail': True,
+        }
+        if cookie_path: ydl_opts['cookiefile'] = cookie_path
+
+        postprocessors = []
+        if spec is None:
+            postprocessors.append({'key': 'FFmpegExtractAudio','preferredcodec': output_format})
+            if quality_val != '0':
+                postprocessors[0]['preferredquality'] = quality_val
+        postprocessors.append({'key': 'FFmpegThumbnailsConvertor', 'format': 'jpg', 'when': 'before_dl'})
+        ydl_opts.update({'postprocessors': postprocessors})
+
+        started = time.perf_counter()
+        try:
+            with default_pool.acquire(ydl_opts) as ydl:
+                # 一時的なエラー・レート制限は待ってから再試行する (途中ファイルがあれば続きから)
+                default_scheduler.call(info['url'], lambda: ydl.download([info['url']]), on_retry=hooks.retry)
+        except Exception as e:
+            timer.record(info['url'], time.perf_counter() - started, error=e)
+            raise
+        finally:
+            ffmpeg_gate.release()
+        timer.record(info['url'], time.perf_counter() - started)
+
+        if target_dir != work_dir:
+            for name in os.listdir(target_dir):
+                shutil.move(os.path.join(target_dir, name), os.path.join(work_dir, name))
+        if spec is not None:
+            transcode_filtered(work_dir)
+
+    audio_path = os.path.join(out_dir, f"{final_filename}.{OUTPUT_FORMATS[output_format]['ext']}")
+    key = transcode_key(info['url'], output_format, quality_val, variant_key(spec))
+    # 前回の完成ファイルは上書きせず作り直す (成果物ストアとハードリンクで共有している場合がある)
+    if os.path.exists(audio_path):
+        os.unlink(audio_path)
+    thumb_data, _ = transcode_cache.fetch(key, produce, audio_path)
+    if not produced:
+        default_metrics.count('transcode_cache_hit')
+
+    cover_data = custom_cover
+    if not cover_data and options['embed_thumb'] and thumb_data:
+        with default_metrics.timed('thumbnail', url=info['url']) as span:
+            span['bytes'] = len(thumb_data)
+            try:
+                cover_data = normalize_cover(thumb_data)
+            except ValueError:
+                cover_data = None
+    hooks.stage('tagging')
+    with default_metrics.timed('tagging', url=info['url']) as span:
+        apply_tags(
+            audio_path,
+            title=info.get('custom_title', ''),
+            artist=info.get('custom_artist', ''),
+            album=info.get('custom_album', ''),
+            cover_data=cover_data
+        )
+        span['bytes'] = os.path.getsize(audio_path)
+    return audio_path
+
+
+def download_batch(info_list, options, work_dir, cookie_path, transcode_cache, report, workspace=None, owner=None):
+    """info_list を options['max_workers'] 件ずつ並列にダウンロードする
+
+    戻り値は入力順の {'path': 完成したファイル or None, 'error': エラー文字列 or None} のリスト。
+    各アイテムの状態は report(index, status, fraction, detail) で通知し、
+    status は 'downloading' / 'converting' / 'done' / 'error' のいずれか、fraction はアイテム全体の進捗 (0〜1)。
+    detail はダウンロード中ならバイト数・速度 (バイト/秒)、変換中なら段階 ('stage') を持つ (ProgressHooks を参照)。
+    workspace (Workspace) を渡すと、作業ファイルをそこに置いてアイテムの状態を記録し、
+    同じ内容で完成済みのアイテムはダウンロードせずに再利用する。
+    各アイテムはプロセス全体の実行枠 (governor) を owner (セッション) 単位で順番に受け取ってから処理し、
+    待っている間は status 'queued'、detail {'position': 前にある件数} を通知する。
+    """
+    results = [{'path': None, 'error': None} for _ in info_list]
+
+    def tracked_report(index, status, fraction, detail):
+        if workspace is not None:
+            if status == 'downloading':
+                workspace.set_state(index, DOWNLOADING)
+            elif status == 'converting':
+                workspace.set_state(index, TRANSCODING)
+        report(index, status, fraction, detail)
+
+    def run_item(idx, info, out_dir, hooks, download_dir):
+        def on_wait(position):
+            report(idx, 'queued', 0.0, {'position': position})
+
+        with default_governor.slot(owner, estimate_item_bytes(info), on_wait):
+            hooks.started()
+            with default_metrics.timed('item', url=info['url']) as span:
+                path = download_item(info, out_dir, options, cookie_path, transcode_cache, hooks, download_dir)
+                span['bytes'] = os.path.getsize(path)
+        return path
+
+    with default_metrics.timed('batch', items=len(info_list)) as span, \
+            ThreadPoolExecutor(max_workers=options['max_workers']) as executor:
+        futures = {}
+        for idx, info in enumerate(info_list):
+            download_dir = None
+            if workspace is None:
+                # 同名ファイルの衝突を避けるため、アイテムごとに作業ディレクトリを分ける
+                out_dir = os.path.join(work_dir, str(idx))
+                os.makedirs(out_dir, exist_ok=True)
+            else:
+                fingerprint = item_fingerprint(info, options)
+                finished = workspace.finished_path(idx, fingerprint)
+                if finished:
+                    results[idx]['path'] = finished
+                    report(idx, 'done', 1.0, {'resumed': True})
+                    continue
+                out_dir = workspace.item_dir(idx)
+                download_dir = workspace.download_dir(idx)
+                workspace.set_state(idx, PENDING, fingerprint=fingerprint, path=None)
+            hooks = ProgressHooks(idx, tracked_report)
+            futures[executor.submit(run_item, idx, info, out_dir, hooks, download_dir)] = idx
+
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                results[idx]['path'] = future.result()
+                span['bytes'] += os.path.getsize(results[idx]['path'])
+                if workspace is not None:
+                    workspace.set_state(idx, TAGGED, path=results[idx]['path'])
+                report(idx, 'done', 1.0, {})
+            except Exception as e:
+                # ダウンロードエラーでも他のアイテムは続行 (途中ファイルは作業ディレクトリに残る)
+                results[idx]['error'] = str(e)
+                report(idx, 'error', 1.0, {'error': str(e)})
+
+    return results
@@ -0,0 +1,120 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from pipeline import cookie_file, iter_playlist_pages
+
+# 展開の状態
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+# 終了した展開の情報を保持する時間 (秒)
+_RETENTION = 60 * 60
+
+
+class PlaylistExpander:
+    """プレイリスト・チャンネルのURLをバックグラウンドで展開する
+
+    展開した (URL, メタデータ) はページ単位で追記していき、
+    UIは get() で前回以降に増えた分を受け取ってプレビューへ追加する。
+    状態はメモリ上だけに持つ (再起動後は展開し直す)。
+    """
+
+    def __init__(self, workers=settings.PLAYLIST_WORKERS):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="playlist")
+
+    def submit(self, urls, cookie_content=None):
+        """展開を開始し、展開IDを返す"""
+        expansion_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            self._states[expansion_id] = {
+                'status': RUNNING,
+                'entries': [],
+                'errors': [],
+                'cancelled': False,
+                'discarded': False,
+                'updated_at': time.time(),
+            }
+        self._executor.submit(self._run, expansion_id, urls, cookie_content)
+        return expansion_id
+
+    def get(self, expansion_id, start=0):
+        """start件目以降のエントリと状態を返す。見つからなければNone"""
+        with self._lock:
+            state = self._states.get(expansion_id)
+            if state is None:
+                return None
+            return {
+                'status': state['status'],
+                'entries': state['entries'][start:],
+                'total': len(state['entries']),
+                'errors': list(state['errors']),
+            }
+
+    def cancel(self, expansion_id):
+        """展開を中止する (取得中のページが終わった時点で止まる)"""
+        with self._lock:
+            state = self._states.get(expansion_id)
+            if state is not None:
+                state['cancelled'] = True
+
+    def discard(self, expansion_id):
+        """展開を中止して状態を破棄する (実行中なら終了時に破棄する)"""
+        with self._lock:
+            state = self._states.get(expansion_id)
+            if state is None:
+                return
+            if state['status'] == RUNNING:
+                state['cancelled'] = True
+                state['discarded'] = True
+            else:
+                del self._states[expansion_id]
+
+    def _prune(self):
+        # ロック取得済みの状態で呼ぶこと
+        cutoff = time.time() - _RETENTION
+        for expansion_id, state in list(self._states.items()):
+            if state['status'] != RUNNING and state['updated_at'] < cutoff:
+                del self._states[expansion_id]
+
+    def _append(self, expansion_id, entries=(), error=None):
+        with self._lock:
+            state = self._states[expansion_id]
+            state['entries'].extend(entries)
+            if error:
+                state['errors'].append(error)
+            state['updated_at'] = time.time()
+            return not state['cancelled']
+
+    def _run(self, expansion_id, urls, cookie_content):
+        cookie_path = cookie_file(cookie_content)
+        for url in urls:
+            try:
+                for page in iter_playlist_pages(url, cookie_path):
+                    if not self._append(expansion_id, page):
+                        break
+            except Exception as e:
+                # 1つのURLで失敗しても残りのURLは続行
+                traceback.print_exc()
+                self._append(expansion_id, error=f"{url}: {e}")
+            if self._is_cancelled(expansion_id):
+                break
+
+        with self._lock:
+            state = self._states[expansion_id]
+            if state['discarded']:
+                del self._states[expansion_id]
+                return
+            state['status'] = CANCELLED if state['cancelled'] else DONE
+            state['updated_at'] = time.time()
+
+    def _is_cancelled(self, expansion_id):
+        with self._lock:
+            return self._states[expansion_id]['cancelled']
@@ -0,0 +1,160 @@
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import settings
+from metadata_cache import host_matches
+
+# エラーの分類
+THROTTLED = 'throttled'   # レート制限・ボット確認: ホスト全体で間隔を空けて再試行
+TRANSIENT = 'transient'   # 一時的な通信エラー: そのリクエストだけ再試行
+PERMANENT = 'permanent'   # 再試行しても変わらない (非公開・削除済み・404など)
+
+_THROTTLED_RE = re.compile(r"HTTP Error 429|Too Many Requests|rate.?limit|Sign in to confirm|not a bot", re.I)
+_PERMANENT_RE = re.compile(
+    r"HTTP Error 4\d\d|Video unavailable|Private video|has been removed|not available|"
+    r"Unsupported URL|members-only|copyright|Incomplete YouTube ID|is not a valid URL",
+    re.I,
+)
+_TRANSIENT_RE = re.compile(
+    r"HTTP Error 5\d\d|timed? ?out|Connection (reset|refused|aborted)|Remote end closed|"
+    r"Temporary failure|Name or service not known|IncompleteRead|EOF occurred|"
+    r"Unable to download (webpage|API page|JSON)|Got error|giving up after",
+    re.I,
+)
+_YOUTUBE_HOSTS = ('youtube.com', 'youtu.be', 'googlevideo.com', 'ytimg.com')
+
+
+def classify_error(error):
+    """例外を THROTTLED / TRANSIENT / PERMANENT に分類する"""
+    message = str(error)
+    if _THROTTLED_RE.search(message):
+        return THROTTLED
+    if _PERMANENT_RE.search(message):
+        return PERMANENT
+    if isinstance(error, (ConnectionError, TimeoutError)) or _TRANSIENT_RE.search(message):
+        return TRANSIENT
+    return PERMANENT
+
+
+def host_key(url):
+    """レート制限の単位: YouTube関連のホストはまとめて1つとして扱う"""
+    host = (urlparse(url).hostname or '').lower()
+    if host_matches(host, _YOUTUBE_HOSTS):
+        return 'youtube'
+    return host
+
+
+class TokenBucket:
+    """ホストごとのトークンバケット
+
+    レート制限を受けると速度を半分に落として一定時間停止し、成功が続くと元の速度へ少しずつ戻す (AIMD)。
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する (なければ補充されるまで待つ)"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, pause):
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class RequestScheduler:
+    """yt-dlpの呼び出しをまとめて制御するスケジューラ (プロセス内の全セッションで共有)
+
+    - ホストごとのトークンバケットで呼び出し間隔を制限する
+    - 同時に実行する呼び出し数をプロセス全体で max_concurrency 件に抑える
+    - 再試行できるエラーは、ジッター付きの指数バックオフで max_attempts 回まで再試行する
+    """
+
+    def __init__(self, rate=settings.SCHEDULER_RATE, burst=settings.SCHEDULER_BURST,
+                 max_concurrency=settings.SCHEDULER_MAX_CONCURRENCY, max_attempts=settings.SCHEDULER_MAX_ATTEMPTS,
+                 backoff_base=settings.SCHEDULER_BACKOFF_BASE, backoff_max=settings.SCHEDULER_BACKOFF_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, url):
+        key = host_key(url)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def backoff(self, attempt, kind):
+        """attempt回目の失敗後の待ち時間 (秒)。上限の半分 + ランダムなジッター"""
+        base = self.backoff_base * (4 if kind == THROTTLED else 1)
+        cap = min(self.backoff_max, base * 2 ** (attempt - 1))
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def call(self, url, fn, on_retry=None, max_attempts=None):
+        """fn() を実行して結果を返す。再試行できないエラーか、回数を使い切ったら最後の例外を送出する
+
+        on_retry(attempt, delay, error) は再試行の待機に入る前に呼ばれる。
+        max_attempts でこの呼び出しの試行回数を変えられる (1なら再試行しない)。
+        """
+        max_attempts = self.max_attempts if max_attempts is None else max_attempts
+        bucket = self._bucket(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            bucket.acquire()
+            with self._slots:
+                try:
+                    result = fn()
+                except Exception as e:
+                    error = e
+                else:
+                    bucket.reward()
+                    return result
+
+            # 待機中は同時実行枠を占有しない
+            kind = classify_error(error)
+            if kind == PERMANENT or attempt >= max_attempts:
+                raise error
+            delay = self.backoff(attempt, kind)
+            if kind == THROTTLED:
+                # 同じホストへの他のリクエストもまとめて待たせ、一斉に再試行しないようにする
+                bucket.penalize(delay)
+            if on_retry is not None:
+                on_retry(attempt, delay, error)
+            time.sleep(delay)
+
+
+# プロセス全体で共有するスケジューラ
+default_scheduler = RequestScheduler()
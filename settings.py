@@ -0,0 +1,101 @@
+import os
+import tempfile
+
+# ── 共通設定: 環境変数で上書き可能 ──
+
+# キャッシュ・作業ファイルの保存先 (プロセス・セッション間で共有)
+CACHE_DIR = os.environ.get(
+    "AUDIO_DL_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "audio_downloader_cache"),
+)
+
+# メタデータキャッシュ
+METADATA_CACHE_TTL = int(os.environ.get("AUDIO_DL_METADATA_TTL", 24 * 60 * 60))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("AUDIO_DL_METADATA_MAX_ENTRIES", 5000))
+
+# メタデータ解析の同時実行数
+METADATA_WORKERS = int(os.environ.get("AUDIO_DL_METADATA_WORKERS", 8))
+
+# yt-dlp呼び出しのスケジューラ (プロセス全体で共有):
+# ホストごとの呼び出しレート (回/秒) とバースト、全体の同時実行数、再試行回数、バックオフ (秒)
+SCHEDULER_RATE = float(os.environ.get("AUDIO_DL_SCHEDULER_RATE", 2.0))
+SCHEDULER_BURST = int(os.environ.get("AUDIO_DL_SCHEDULER_BURST", 5))
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("AUDIO_DL_SCHEDULER_MAX_CONCURRENCY", 8))
+SCHEDULER_MAX_ATTEMPTS = int(os.environ.get("AUDIO_DL_SCHEDULER_MAX_ATTEMPTS", 4))
+SCHEDULER_BACKOFF_BASE = float(os.environ.get("AUDIO_DL_SCHEDULER_BACKOFF_BASE", 2.0))
+SCHEDULER_BACKOFF_MAX = float(os.environ.get("AUDIO_DL_SCHEDULER_BACKOFF_MAX", 60.0))
+
+# 重い処理の実行枠 (プロセス内の全セッションで共有): 同時に処理するアイテム数、
+# 同時に動かす変換 (ffmpeg) の数、処理中のアイテムが一時ディスクに置く見込みの合計 (バイト)
+GOVERNOR_SLOTS = int(os.environ.get("AUDIO_DL_GOVERNOR_SLOTS", 8))
+GOVERNOR_FFMPEG_SLOTS = int(os.environ.get("AUDIO_DL_GOVERNOR_FFMPEG_SLOTS", os.cpu_count() or 1))
+GOVERNOR_DISK_QUOTA = int(os.environ.get("AUDIO_DL_GOVERNOR_DISK_QUOTA", 4 * 1024 ** 3))
+
+# 進捗の通知間隔 (秒): 同じ状態の更新はアイテムごとにこの間隔へまとめる
+PROGRESS_INTERVAL = float(os.environ.get("AUDIO_DL_PROGRESS_INTERVAL", 0.5))
+
+# 音量の正規化 (EBU R128): 既定の目標ラウドネス (LUFS)・トゥルーピークの上限 (dBTP)・ラウドネスレンジ (LU)
+NORMALIZE_LOUDNESS = float(os.environ.get("AUDIO_DL_NORMALIZE_LOUDNESS", -14.0))
+NORMALIZE_TRUE_PEAK = float(os.environ.get("AUDIO_DL_NORMALIZE_TRUE_PEAK", -1.5))
+NORMALIZE_LRA = float(os.environ.get("AUDIO_DL_NORMALIZE_LRA", 11.0))
+# 前後の無音の削除: これより小さい音 (dB) を無音とみなす
+SILENCE_THRESHOLD = float(os.environ.get("AUDIO_DL_SILENCE_THRESHOLD", -50.0))
+
+# 段階ごとの処理時間の計測: JSON Linesの出力先 (空なら出力しない) と、
+# Prometheus形式のテキストを返すHTTPサーバーのポート (0なら起動しない)
+METRICS_LOG = os.environ.get("AUDIO_DL_METRICS_LOG", "")
+METRICS_PORT = int(os.environ.get("AUDIO_DL_METRICS_PORT", 0))
+METRICS_HOST = os.environ.get("AUDIO_DL_METRICS_HOST", "127.0.0.1")
+
+# 起動時の事前準備: 最初のリクエストより前に、バックグラウンドでyt-dlpの読み込み・抽出器の初期化と
+# ffmpegの確認を済ませておく ("0" で無効)
+WARMUP = os.environ.get("AUDIO_DL_WARMUP", "1") != "0"
+
+# YoutubeDLインスタンスのプール: 設定ごとに待機させておく数と、yt-dlpのディスクキャッシュ (署名の解析結果等)
+YDL_POOL_MAX_IDLE = int(os.environ.get("AUDIO_DL_YDL_POOL_MAX_IDLE", 4))
+YDL_CACHE_DIR = os.path.join(CACHE_DIR, "yt-dlp")
+
+# 完成したMP3・ZIP・アップロードファイルの保存先 (内容アドレス方式のストア)
+ARTIFACT_DIR = os.path.join(CACHE_DIR, "artifacts")
+ARTIFACT_MAX_BYTES = int(os.environ.get("AUDIO_DL_ARTIFACT_MAX_BYTES", 2 * 1024 ** 3))
+ARTIFACT_SESSION_MAX_BYTES = int(os.environ.get("AUDIO_DL_ARTIFACT_SESSION_MAX_BYTES", 512 * 1024 ** 2))
+# この秒数アクセスのないセッションは放置とみなして参照を破棄する
+ARTIFACT_SESSION_IDLE = int(os.environ.get("AUDIO_DL_ARTIFACT_SESSION_IDLE", 60 * 60))
+
+# ZIPを無圧縮 (store) で作成するか (MP3はDEFLATEしてもほぼ縮まない)
+ZIP_STORE_ONLY = os.environ.get("AUDIO_DL_ZIP_STORE_ONLY", "1") != "0"
+
+# 変換済み (タグなし) 音声のキャッシュ (セッション間で共有)
+TRANSCODE_CACHE_DIR = os.path.join(CACHE_DIR, "transcodes")
+TRANSCODE_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_DL_TRANSCODE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# タグ一括書き込み: この件数以上でプロセスプールを使う
+TAG_POOL_MIN_BATCH = int(os.environ.get("AUDIO_DL_TAG_POOL_MIN_BATCH", 16))
+TAG_POOL_WORKERS = int(os.environ.get("AUDIO_DL_TAG_POOL_WORKERS", os.cpu_count() or 1))
+
+# カバー画像: 埋め込み用は長辺COVER_MAX_DIMのJPEG、プレビュー用はさらに小さく
+COVER_MAX_DIM = int(os.environ.get("AUDIO_DL_COVER_MAX_DIM", 800))
+COVER_JPEG_QUALITY = int(os.environ.get("AUDIO_DL_COVER_JPEG_QUALITY", 85))
+PREVIEW_MAX_DIM = int(os.environ.get("AUDIO_DL_PREVIEW_MAX_DIM", 320))
+PREVIEW_JPEG_QUALITY = int(os.environ.get("AUDIO_DL_PREVIEW_JPEG_QUALITY", 75))
+COVER_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_DL_COVER_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+
+# プレビュー・タグ編集画面で1ページに表示するカードの件数
+PREVIEW_PAGE_SIZE = int(os.environ.get("AUDIO_DL_PREVIEW_PAGE_SIZE", 20))
+
+# バックグラウンドジョブ: 同時に実行するジョブ数と、完了したジョブ情報の保持期間 (秒)
+# 実際に同時に処理するアイテム数は GOVERNOR_SLOTS で抑えるので、ジョブ自体は多めに並行させて
+# 後から投入したセッションも順番待ちに加われるようにする
+JOB_WORKERS = int(os.environ.get("AUDIO_DL_JOB_WORKERS", 16))
+JOB_RETENTION = int(os.environ.get("AUDIO_DL_JOB_RETENTION", 24 * 60 * 60))
+
+# ジョブの作業ディレクトリ (途中のダウンロードを残し、再投入時に再開する) と、放置されたものを削除するまでの秒数
+WORKSPACE_DIR = os.path.join(CACHE_DIR, "workspaces")
+WORKSPACE_RETENTION = int(os.environ.get("AUDIO_DL_WORKSPACE_RETENTION", 24 * 60 * 60))
+# 保持期間を過ぎたジョブ・作業ディレクトリの削除を、ジョブの終了時に行う最短の間隔 (秒)
+JOB_SWEEP_INTERVAL = int(os.environ.get("AUDIO_DL_JOB_SWEEP_INTERVAL", 10 * 60))
+
+# プレイリスト・チャンネルの展開: プレビューへ追加する単位 (件)、1つのURLから展開する上限、同時に展開するURL数
+PLAYLIST_PAGE_SIZE = int(os.environ.get("AUDIO_DL_PLAYLIST_PAGE_SIZE", 50))
+PLAYLIST_MAX_ENTRIES = int(os.environ.get("AUDIO_DL_PLAYLIST_MAX_ENTRIES", 1000))
+PLAYLIST_WORKERS = int(os.environ.get("AUDIO_DL_PLAYLIST_WORKERS", 2))
@@ -0,0 +1,250 @@
+import base64
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from mutagen.flac import Picture
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, APIC, ID3NoHeaderError, error as ID3Error
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
+
+import settings
+from covers import cover_mime
+
+# コピー時の読み込み単位
+CHUNK_SIZE = 1024 * 1024
+
+# MP3フレーム同期の確認で読む範囲 (タグ直後から)
+SYNC_SCAN_BYTES = 64 * 1024
+_FRAME_SYNC_RE = re.compile(rb'\xff[\xe0-\xff]')
+
+
+def audio_range(fileobj):
+    """既存のID3v2ヘッダとID3v1フッタを除いた、音声フレーム部分の (開始, 終了) オフセットを返す"""
+    fileobj.seek(0, os.SEEK_END)
+    end = fileobj.tell()
+    fileobj.seek(0)
+
+    start = 0
+    header = fileobj.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = 0
+        for b in header[6:10]:
+            size = (size << 7) | (b & 0x7f)
+        start = 10 + size
+        if header[5] & 0x10:  # フッタ付き
+            start += 10
+
+    if end - start >= 128:
+        fileobj.seek(end - 128)
+        if fileobj.read(3) == b'TAG':
+            end -= 128
+
+    return min(start, end), end
+
+
+def read_tags(fileobj):
+    """ID3v2タグ部分だけを読み、編集に使う値 (タイトル・アーティスト・アルバム・カバー) を返す
+
+    ファイル全体は解析せず、タグ直後にMP3フレームの同期ビットがあるかだけ確認する。
+    """
+    fileobj.seek(0)
+    try:
+        tags = ID3(fileobj)
+    except ID3NoHeaderError:
+        tags = None
+
+    start, _ = audio_range(fileobj)
+    fileobj.seek(start)
+    if not _FRAME_SYNC_RE.search(fileobj.read(SYNC_SCAN_BYTES)):
+        raise ValueError("MP3フレームが見つかりません")
+
+    if tags is None:
+        return {'title': '', 'artist': '', 'album': '', 'cover_bytes': None}
+    covers = tags.getall('APIC')
+    return {
+        'title': str(tags['TIT2']) if 'TIT2' in tags else '',
+        'artist': str(tags['TPE1']) if 'TPE1' in tags else '',
+        'album': str(tags['TALB']) if 'TALB' in tags else '',
+        'cover_bytes': covers[0].data if covers else None,
+    }
+
+
+def build_tag_header(source_path, title, artist, album, cover_data=None):
+    """既存タグを引き継いだ新しいID3v2ヘッダをメモリ上で作り、(ヘッダ, 音声開始, 音声終了) を返す"""
+    try:
+        tags = ID3(source_path)
+    except ID3NoHeaderError:
+        tags = ID3()
+
+    if title: tags.add(TIT2(encoding=3, text=title))
+    if artist: tags.add(TPE1(encoding=3, text=artist))
+    if album: tags.add(TALB(encoding=3, text=album))
+
+    if cover_data:
+        tags.delall('APIC')
+        tags.add(
+            APIC(
+                encoding=3,
+                mime=cover_mime(cover_data),
+                type=3,
+                desc='Cover',
+                data=cover_data
+            )
+        )
+
+    # 空のバッファへ保存するとタグ部分だけが書き出される (ID3v1は付けない)
+    buf = io.BytesIO()
+    tags.save(buf, v1=0)
+
+    with open(source_path, 'rb') as f:
+        start, end = audio_range(f)
+    return buf.getvalue(), start, end
+
+
+# ── ダウンロードしたファイルへのタグ書き込み (形式ごと) ──
+def _write_id3(file_path, title, artist, album, cover_data):
+    audio = MP3(file_path, ID3=ID3)
+    try:
+        audio.add_tags()
+    except ID3Error:
+        pass
+
+    if title: audio.tags.add(TIT2(encoding=3, text=title))
+    if artist: audio.tags.add(TPE1(encoding=3, text=artist))
+    if album: audio.tags.add(TALB(encoding=3, text=album))
+
+    if cover_data:
+        audio.tags.add(
+            APIC(
+                encoding=3,
+                mime=cover_mime(cover_data),
+                type=3,
+                desc='Cover',
+                data=cover_data
+            )
+        )
+    audio.save()
+
+
+def _write_mp4(file_path, title, artist, album, cover_data):
+    audio = MP4(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+
+    if title: audio.tags['\xa9nam'] = [title]
+    if artist: audio.tags['\xa9ART'] = [artist]
+    if album: audio.tags['\xa9alb'] = [album]
+
+    if cover_data:
+        image_format = MP4Cover.FORMAT_PNG if cover_mime(cover_data) == 'image/png' else MP4Cover.FORMAT_JPEG
+        audio.tags['covr'] = [MP4Cover(cover_data, imageformat=image_format)]
+    audio.save()
+
+
+def _write_vorbis_comment(audio_class):
+    def write(file_path, title, artist, album, cover_data):
+        audio = audio_class(file_path)
+        if title: audio['title'] = [title]
+        if artist: audio['artist'] = [artist]
+        if album: audio['album'] = [album]
+
+        if cover_data:
+            # Ogg ではFLAC形式のPICTUREブロックをbase64にして METADATA_BLOCK_PICTURE に入れる
+            picture = Picture()
+            picture.type = 3
+            picture.mime = cover_mime(cover_data)
+            picture.desc = 'Cover'
+            picture.data = cover_data
+            audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+        audio.save()
+    return write
+
+
+_TAG_WRITERS = {
+    '.mp3': _write_id3,
+    '.m4a': _write_mp4,
+    '.opus': _write_vorbis_comment(OggOpus),
+    '.ogg': _write_vorbis_comment(OggVorbis),
+}
+
+
+def apply_tags(file_path, title, artist, album, cover_data=None):
+    """拡張子に応じた形式 (ID3 / MP4 / Vorbisコメント) でタグを書き込む
+
+    書き込めなければ例外を送出する (タグのないファイルを完成として扱わない)。
+    """
+    writer = _TAG_WRITERS.get(os.path.splitext(file_path)[1].lower())
+    if writer is None:
+        raise ValueError(f"タグに対応していない形式です: {file_path}")
+    try:
+        writer(file_path, title, artist, album, cover_data)
+    except Exception as e:
+        raise RuntimeError(f"タグの書き込みに失敗しました: {e}") from e
+
+
+def _build_job(job):
+    # プロセスプールから呼ぶためトップレベルに置く
+    try:
+        header, start, end = build_tag_header(
+            job['source'], job['title'], job['artist'], job['album'], job.get('cover_data')
+        )
+        return {'header': header, 'start': start, 'end': end, 'error': None}
+    except Exception as e:
+        return {'header': None, 'start': 0, 'end': 0, 'error': str(e) or repr(e)}
+
+
+def _copy_range(src, dest, start, end):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        dest.write(chunk)
+        remaining -= len(chunk)
+
+
+def _pool_context():
+    # Streamlitのサーバープロセスはマルチスレッドなので、forkを避ける
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def write_tagged_batch(jobs, zip_writer, workers=settings.TAG_POOL_WORKERS, pool_threshold=settings.TAG_POOL_MIN_BATCH):
+    """タグを書き換えたファイルをZIPへ直接書き出す
+
+    元ファイルは書き換えず、新しいID3v2ヘッダ + 元の音声フレームをそのままエントリへ流し込む。
+    jobs は {'source', 'arcname', 'title', 'artist', 'album', 'cover_data'} のリスト。
+    件数が pool_threshold 以上ならヘッダ生成をプロセスプールで並列化する。
+    戻り値は入力順の {'arcname', 'error'} のリスト (成功時 error は None、arcnameは実際のエントリ名)。
+    """
+    if len(jobs) >= pool_threshold and workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+        built = executor.map(_build_job, jobs, chunksize=4)
+    else:
+        executor = None
+        built = map(_build_job, jobs)
+
+    results = []
+    try:
+        for job, result in zip(jobs, built):
+            if result['error']:
+                results.append({'arcname': job['arcname'], 'error': result['error']})
+                continue
+            try:
+                with open(job['source'], 'rb') as src, zip_writer.open_entry(job['arcname']) as (arcname, dest):
+                    dest.write(result['header'])
+                    _copy_range(src, dest, result['start'], result['end'])
+                results.append({'arcname': arcname, 'error': None})
+            except OSError as e:
+                results.append({'arcname': job['arcname'], 'error': str(e)})
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
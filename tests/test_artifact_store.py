@@ -0,0 +1,21 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artifact_store import ArtifactStore  # noqa: E402
+
+
+def test_cleanup_keeps_live_staging_dir(tmp_path):
+    store = ArtifactStore(root=str(tmp_path), session_idle=0)
+    stale = store.new_staging_dir()
+    with store.staging_dir() as live:
+        # 作成から時間の経った作業ディレクトリでも、使用中なら掃除で消さない
+        past = time.time() - 60
+        for path in (stale, live):
+            os.utime(path, (past, past))
+        store.cleanup_abandoned()
+        assert os.path.isdir(live)
+        assert not os.path.exists(stale)
+    assert not os.path.exists(live)
@@ -0,0 +1,34 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_filters import trailing_silence_start  # noqa: E402
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is required")
+
+
+@pytest.fixture
+def gapped(tmp_path):
+    # 無音1秒 → 音3秒 → 曲中の無音2秒 → 音3秒 → 末尾の無音4秒
+    path = str(tmp_path / "gapped.wav")
+    subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i',
+         "aevalsrc='if(between(t,1,4)+between(t,6,9),0.5*sin(2*PI*440*t),0)':d=13:s=48000", path],
+        check=True,
+    )
+    return path
+
+
+def test_trailing_silence_ignores_pauses_inside_the_track(gapped):
+    assert trailing_silence_start(gapped, {'trim_silence': True}) == pytest.approx(9.0, abs=0.05)
+
+
+def test_trailing_silence_within_clip(gapped):
+    assert trailing_silence_start(gapped, {'start': 2.0, 'end': 12.0}) == pytest.approx(9.0, abs=0.05)
+    # 切り出す範囲の最後が音なら削らない
+    assert trailing_silence_start(gapped, {'start': 2.0, 'end': 8.0}) is None
@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from governor import ResourceGovernor  # noqa: E402
+
+
+class _Abort(Exception):
+    pass
+
+
+def _abort(position):
+    # Streamlitの再実行 (RerunException) のように、待っている間のUI更新が例外で抜ける場合
+    raise _Abort()
+
+
+def test_aborted_waiter_leaves_queue():
+    governor = ResourceGovernor(slots=1, ffmpeg_slots=1, disk_quota=0)
+    holder = governor.slot('x')
+    holder.__enter__()
+
+    with pytest.raises(_Abort):
+        with governor.slot('a', on_wait=_abort):
+            pass
+    assert governor.snapshot()['waiting'] == 0
+
+    # 中断した待機者が先頭に残っていると、後から来たセッションは枠を受け取れない
+    acquired = threading.Event()
+
+    def run():
+        with governor.slot('b'):
+            acquired.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    holder.__exit__(None, None, None)
+    assert acquired.wait(5)
+    thread.join(5)
+    assert governor.snapshot() == {'running': 0, 'waiting': 0, 'sessions': 0, 'disk_used': 0}
+
+
+def test_aborted_waiter_behind_others():
+    governor = ResourceGovernor(slots=1, ffmpeg_slots=1, disk_quota=0)
+    holder = governor.slot('x')
+    holder.__enter__()
+
+    # 先に待っている別セッションの後ろで中断しても、前の待機者はそのまま枠を受け取れる
+    positions = []
+    acquired = threading.Event()
+
+    def run():
+        with governor.slot('b', on_wait=positions.append):
+            acquired.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while not positions:
+        threading.Event().wait(0.01)
+
+    def abort_behind(position):
+        assert position == 1
+        raise _Abort()
+
+    with pytest.raises(_Abort):
+        with governor.slot('a', on_wait=abort_behind):
+            pass
+
+    holder.__exit__(None, None, None)
+    assert acquired.wait(5)
+    thread.join(5)
+    assert governor.snapshot()['waiting'] == 0
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs  # noqa: E402
+import settings  # noqa: E402
+
+
+def _wait_finished(manager, job_id):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in jobs.TERMINAL_STATUSES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job did not finish: {job['status']}")
+
+
+def test_workspace_error_fails_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'WORKSPACE_DIR', str(tmp_path / "workspaces"))
+
+    def broken_workspace(path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(jobs, 'Workspace', broken_workspace)
+    manager = jobs.JobManager(None, None, path=str(tmp_path / "jobs.sqlite3"), workers=1)
+    job_id = manager.submit('owner', [{'url': 'https://example.com/a', 'custom_filename': 'a'}], {'quality': '0'})
+
+    job = _wait_finished(manager, job_id)
+    # 作業ディレクトリを用意できなければ実行中のまま残さず失敗にし、一括処理の名前も解放する
+    assert job['status'] == jobs.FAILED
+    assert 'disk full' in job['error']
+    assert manager._active_batches == set()
+
+
+def test_finished_job_sweeps_stale_workspaces(tmp_path, monkeypatch):
+    root = tmp_path / "workspaces"
+    monkeypatch.setattr(settings, 'WORKSPACE_DIR', str(root))
+    monkeypatch.setattr(settings, 'JOB_SWEEP_INTERVAL', 0)
+    manager = jobs.JobManager(None, None, path=str(tmp_path / "jobs.sqlite3"), workers=1)
+
+    # 起動後に放置された作業ディレクトリも、次にジョブが終わったときに削除される
+    stale = root / "stale"
+    stale.mkdir(parents=True)
+    old = time.time() - settings.WORKSPACE_RETENTION - 60
+    os.utime(stale, (old, old))
+    # 実行中の一括処理の作業ディレクトリは古くても残す
+    running = root / "running"
+    running.mkdir()
+    os.utime(running, (old, old))
+    manager._active_batches.add("running")
+
+    job_id = manager.submit('owner', [], {'quality': '0'})
+    _wait_finished(manager, job_id)
+    assert not stale.exists()
+    assert running.exists()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_cache import canonical_url, dedupe_urls, is_collection_url  # noqa: E402
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+def test_youtube_urls_are_canonicalized():
+    for url in (f"https://m.youtube.com/watch?v={VIDEO_ID}&t=30", f"https://youtu.be/{VIDEO_ID}",
+                f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}"):
+        assert canonical_url(url) == f"https://www.youtube.com/watch?v={VIDEO_ID}"
+
+
+def test_lookalike_hosts_are_not_youtube():
+    # 末尾が一致するだけの別のホストを、YouTubeの動画に書き換えない
+    url = f"https://notyoutube.com/watch?v={VIDEO_ID}"
+    assert canonical_url(url) == url
+    assert dedupe_urls([url, f"https://youtu.be/{VIDEO_ID}"])[1] == []
+    assert not is_collection_url("https://evil-youtube.com/playlist?list=PL123")
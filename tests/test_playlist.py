@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline  # noqa: E402
+import settings  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+
+URL = "https://example.com/playlist"
+
+
+class _RecordingScheduler(RequestScheduler):
+    def __init__(self):
+        super().__init__(rate=1000, burst=1000, backoff_base=0.001)
+        self.calls = 0
+
+    def call(self, url, fn, on_retry=None, max_attempts=None):
+        self.calls += 1
+        return super().call(url, fn, on_retry=on_retry, max_attempts=max_attempts)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = _RecordingScheduler()
+    monkeypatch.setattr(pipeline, 'default_scheduler', scheduler)
+    monkeypatch.setattr(settings, 'PLAYLIST_PAGE_SIZE', 2)
+    return scheduler
+
+
+def test_paged_list_pages_go_through_scheduler(scheduler):
+    from yt_dlp.utils import OnDemandPagedList
+
+    failures = []
+
+    def get_page(n):
+        # 2ページ目は1回だけ一時的なエラーになる
+        if n == 1 and not failures:
+            failures.append(n)
+            raise OSError("HTTP Error 503: Service Unavailable")
+        return [f"e{i}" for i in range(n * 2, min(n * 2 + 2, 5))]
+
+    entries = OnDemandPagedList(get_page, 2)
+    assert list(pipeline._iter_entries(URL, entries)) == ['e0', 'e1', 'e2', 'e3', 'e4']
+    assert failures == [1]
+    # 3ページ分と、終わりを確かめる空のページ
+    assert scheduler.calls == 4
+
+
+def test_generator_pages_go_through_scheduler_without_retry(scheduler):
+    pulled = []
+
+    def entries():
+        for i in range(3):
+            pulled.append(i)
+            yield f"e{i}"
+        raise OSError("HTTP Error 503: Service Unavailable")
+
+    seen = []
+    with pytest.raises(OSError):
+        for entry in pipeline._iter_entries(URL, entries()):
+            seen.append(entry)
+    # 失敗したジェネレーターは続きから読めないので、再試行せずにエラーをそのまま返す
+    assert seen == ['e0', 'e1']
+    assert pulled == [0, 1, 2]
+    assert scheduler.calls == 2
@@ -0,0 +1,17 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import host_key  # noqa: E402
+
+
+def test_youtube_hosts_share_one_bucket():
+    assert host_key("https://music.youtube.com/watch?v=x") == 'youtube'
+    assert host_key("https://youtu.be/x") == 'youtube'
+    assert host_key("https://rr1---sn-abc.googlevideo.com/videoplayback") == 'youtube'
+
+
+def test_lookalike_hosts_get_their_own_bucket():
+    # 末尾が一致するだけのホストがYouTubeのバケットを使い切ったり、制限を掛けたりしないようにする
+    assert host_key("https://evil-youtube.com/watch?v=x") == 'evil-youtube.com'
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics  # noqa: E402
+from tagging import apply_tags  # noqa: E402
+
+
+def test_tag_error_is_raised_and_counted(tmp_path, capsys):
+    path = tmp_path / "broken.m4a"
+    path.write_bytes(b"not an mp4 file")
+    metrics = Metrics(log_path="")
+
+    with pytest.raises(RuntimeError, match="タグの書き込みに失敗しました"):
+        with metrics.timed('tagging'):
+            apply_tags(str(path), "title", "artist", "album")
+    assert metrics.snapshot()['stages']['tagging']['errors'] == 1
+    assert capsys.readouterr().out == ''
+
+
+def test_unsupported_format_is_raised(tmp_path):
+    path = tmp_path / "audio.wav"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        apply_tags(str(path), "title", "artist", "album")
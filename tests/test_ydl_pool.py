@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ydl_pool import YoutubeDLPool  # noqa: E402
+
+
+def _opts(output_format, quality):
+    return {
+        'quiet': True,
+        'outtmpl': 'audio.%(ext)s',
+        'format': f'bestaudio[ext={output_format}]/bestaudio',
+        'postprocessors': [
+            {'key': 'FFmpegExtractAudio', 'preferredcodec': output_format, 'preferredquality': quality},
+            {'key': 'FFmpegThumbnailsConvertor', 'format': 'jpg', 'when': 'before_dl'},
+        ],
+    }
+
+
+def test_formats_and_postprocessors_share_instance(tmp_path):
+    pool = YoutubeDLPool(max_idle=1, cachedir=str(tmp_path))
+    hooked = []
+
+    with pool.acquire(_opts('mp3', '192')) as first:
+        pass
+    # 出力形式・音質が違っても同じインスタンスを借り、後処理とフォーマットの選択だけが入れ替わる
+    with pool.acquire({**_opts('m4a', '128'), 'postprocessor_hooks': [hooked.append]}) as second:
+        assert second is first
+        assert second.params['format'] == 'bestaudio[ext=m4a]/bestaudio'
+        [extract] = second._pps['post_process']
+        assert extract.mapping == 'm4a'
+        assert len(second._pps['before_dl']) == 1
+        extract._hook_progress({'status': 'started'}, {})
+    assert [d['postprocessor'] for d in hooked] == ['ExtractAudio']
+    pool.close()
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+import settings
+from metadata_cache import cache_key
+
+# キャッシュエントリ内のファイル名
+AUDIO_NAME = "audio"
+COVER_NAME = "audio.jpg"
+
+
+def transcode_key(url, codec, bitrate, variant=''):
+    """(動画ID, コーデック, ビットレート) と加工内容 (音量の正規化・切り出し等) からキャッシュキーを作る"""
+    key = f"{cache_key(url)}|{codec}|{bitrate}"
+    return f"{key}|{variant}" if variant else key
+
+
+class TranscodeCache:
+    """変換済み・タグなしの音声ファイルをセッション間で共有するキャッシュ
+
+    エントリはキーごとのディレクトリに音声本体とサムネイル (jpg) を持つ。
+    容量上限を超えると最終アクセスの古い順に削除する (LRU)。
+    同じキーへの同時リクエストはまとめ、変換は1回だけ実行する。
+    """
+
+    def __init__(self, root=None, max_bytes=settings.TRANSCODE_CACHE_MAX_BYTES):
+        self.root = root or settings.TRANSCODE_CACHE_DIR
+        self.entry_root = os.path.join(self.root, "entries")
+        self.staging_root = os.path.join(self.root, "staging")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._pins = {}
+        os.makedirs(self.entry_root, exist_ok=True)
+        os.makedirs(self.staging_root, exist_ok=True)
+        # 異常終了で残った古い作業ディレクトリを掃除
+        for name in os.listdir(self.staging_root):
+            path = os.path.join(self.staging_root, name)
+            if os.path.getmtime(path) < time.time() - 24 * 60 * 60:
+                shutil.rmtree(path, ignore_errors=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.entry_root, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _pin_if_cached(self, key):
+        # ロック取得済みの状態で呼ぶこと
+        if not self._conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone():
+            return False
+        if not os.path.isdir(self._entry_dir(key)):
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.commit()
+            return False
+        self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        self._pins[key] = self._pins.get(key, 0) + 1
+        return True
+
+    def _unpin(self, key):
+        with self._lock:
+            self._pins[key] -= 1
+            if not self._pins[key]:
+                del self._pins[key]
+
+    def fetch(self, key, produce, dest_path):
+        """キャッシュ済みの音声をdest_pathへコピーし、(サムネイルのbytes or None, ヒットしたか) を返す
+
+        キャッシュにない場合は produce(作業ディレクトリ) を呼んで音声を作らせる。
+        produce は作業ディレクトリに AUDIO_NAME.<codec> (と任意で COVER_NAME) を書き出すこと。
+        """
+        hit = True
+        while True:
+            with self._lock:
+                if self._pin_if_cached(key):
+                    break
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._inflight[key] = future
+
+            if not leader:
+                # 同じキーを変換中の別リクエストを待つ (失敗時は同じ例外を送出)
+                future.result()
+                continue
+
+            hit = False
+            try:
+                self._produce(key, produce)
+            except BaseException as e:
+                with self._lock:
+                    del self._inflight[key]
+                future.set_exception(e)
+                raise
+            with self._lock:
+                del self._inflight[key]
+                pinned = self._pin_if_cached(key)
+            future.set_result(None)
+            if pinned:
+                break
+
+        try:
+            entry_dir = self._entry_dir(key)
+            cover_data = None
+            for name in os.listdir(entry_dir):
+                path = os.path.join(entry_dir, name)
+                if name == COVER_NAME:
+                    with open(path, 'rb') as f:
+                        cover_data = f.read()
+                elif os.path.splitext(name)[0] == AUDIO_NAME:
+                    shutil.copyfile(path, dest_path)
+            return cover_data, hit
+        finally:
+            self._unpin(key)
+
+    def _produce(self, key, produce):
+        work_dir = tempfile.mkdtemp(dir=self.staging_root)
+        try:
+            produce(work_dir)
+            files = [n for n in os.listdir(work_dir) if os.path.splitext(n)[0] == AUDIO_NAME and n != COVER_NAME]
+            if not files:
+                raise RuntimeError("音声ファイルが生成されませんでした")
+            # 音声本体とサムネイル以外 (途中ファイル等) は捨てる
+            for name in os.listdir(work_dir):
+                if name != COVER_NAME and name not in files[:1]:
+                    os.unlink(os.path.join(work_dir, name))
+            size = sum(os.path.getsize(os.path.join(work_dir, n)) for n in os.listdir(work_dir))
+
+            entry_dir = self._entry_dir(key)
+            with self._lock:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.rename(work_dir, entry_dir)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, size, accessed_at) VALUES (?, ?, ?)",
+                    (key, size, time.time()),
+                )
+                self._evict(keep=key)
+                self._conn.commit()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _evict(self, keep=None):
+        # ロック取得済みの状態で呼ぶこと。コピー中 (pin済み) のエントリは削除しない
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in self._pins:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import settings
+
+# アイテムの状態 (マニフェストに保存する)
+PENDING = 'pending'
+DOWNLOADING = 'downloading'
+TRANSCODING = 'transcoding'
+TAGGED = 'tagged'      # タグ付きのファイルが作業ディレクトリにある
+DONE = 'done'          # 成果物として受け渡し済み (ファイルは作業ディレクトリにも残る)
+FINISHED_STATES = (TAGGED, DONE)
+
+MANIFEST_NAME = "manifest.json"
+
+
+def batch_id(info_list, options):
+    """一括処理のID: 同じURL・出力形式・音質の組み合わせなら同じ作業ディレクトリを使う"""
+    payload = json.dumps([[info['url'] for info in info_list], options.get('format', 'mp3'), options['quality']])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def item_fingerprint(info, options):
+    """完成したファイルの内容を決める値のハッシュ (一致すれば再利用できる)"""
+    cover = info.get('custom_cover_bytes')
+    payload = json.dumps({
+        'url': info['url'],
+        'format': options.get('format', 'mp3'),
+        'quality': options['quality'],
+        'embed_thumb': options['embed_thumb'],
+        'loudness': options.get('loudness', settings.NORMALIZE_LOUDNESS) if options.get('normalize') else None,
+        'trim_silence': options.get('trim_silence', False),
+        'start': info.get('custom_start'),
+        'end': info.get('custom_end'),
+        'filename': info.get('custom_filename'),
+        'title': info.get('custom_title'),
+        'artist': info.get('custom_artist'),
+        'album': info.get('custom_album'),
+        'cover': hashlib.sha256(cover).hexdigest() if cover else None,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Workspace:
+    """ジョブごとの永続的な作業ディレクトリと、アイテムの状態を記録するマニフェスト
+
+    アイテムごとに item_<番号>/ を持ち、download/ にはyt-dlpの途中ファイル (.part) を残す。
+    中断・失敗した一括処理を再投入すると、完成済みのアイテムは飛ばし、
+    途中のダウンロードは続きから再開する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._manifest_path = os.path.join(path, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self._manifest_path, encoding='utf-8') as f:
+                self._items = json.load(f)['items']
+        except (OSError, ValueError, KeyError):
+            self._items = {}
+
+    def item_dir(self, index):
+        path = os.path.join(self.path, f"item_{index}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def download_dir(self, index):
+        path = os.path.join(self.item_dir(index), "download")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def get(self, index):
+        with self._lock:
+            return dict(self._items.get(str(index), {'state': PENDING}))
+
+    def set_state(self, index, state, **fields):
+        """アイテムの状態を更新する (状態・値が変わったときだけマニフェストを書き出す)"""
+        with self._lock:
+            entry = self._items.setdefault(str(index), {})
+            if entry.get('state') == state and all(entry.get(k) == v for k, v in fields.items()):
+                return
+            entry.update(fields, state=state, updated_at=time.time())
+            self._save()
+
+    def finished_path(self, index, fingerprint):
+        """同じ内容で完成済みのファイルがあればそのパスを返す"""
+        entry = self.get(index)
+        path = entry.get('path')
+        if entry['state'] in FINISHED_STATES and entry.get('fingerprint') == fingerprint and path and os.path.exists(path):
+            return path
+        return None
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _save(self):
+        # ロック取得済みの状態で呼ぶこと。途中で落ちても壊れないよう置き換えで書き出す
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'items': self._items}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._manifest_path)
+
+
+def cleanup_workspaces(root=None, retention=settings.WORKSPACE_RETENTION, keep=()):
+    """一定時間更新のない作業ディレクトリを削除する (keep に含まれる名前は使用中として残す)"""
+    root = root or settings.WORKSPACE_DIR
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - retention
+    for name in os.listdir(root):
+        if name in keep:
+            continue
+        path = os.path.join(root, name)
+        manifest = os.path.join(path, MANIFEST_NAME)
+        try:
+            updated_at = os.path.getmtime(manifest if os.path.exists(manifest) else path)
+        except OSError:
+            continue
+        if updated_at < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,124 @@
+import atexit
+import json
+import threading
+from contextlib import contextmanager
+
+import settings
+
+# リクエストごとに差し替えるオプション (これ以外が同じなら同じインスタンスを使い回す)
+_PER_REQUEST_KEYS = ('outtmpl', 'progress_hooks', 'postprocessor_hooks', 'format', 'postprocessors')
+
+
+class _PooledYoutubeDL:
+    def __init__(self, params):
+        # yt-dlpの読み込みは重い (数百ms) ため、最初にインスタンスを作るときまで遅らせる
+        import yt_dlp
+        self.ydl = yt_dlp.YoutubeDL(params)
+        self.hooks = []
+        self.pp_hooks = []
+        self._processing = None
+        # 進捗フックは1つずつだけ登録し、貸し出し中のリクエストのフックへ中継する
+        self.ydl.add_progress_hook(self._dispatch)
+        self.ydl.add_postprocessor_hook(self._dispatch_pp)
+
+    def _dispatch(self, d):
+        for hook in self.hooks:
+            hook(d)
+
+    def _dispatch_pp(self, d):
+        for hook in self.pp_hooks:
+            hook(d)
+
+    def set_processing(self, fmt, postprocessors):
+        """フォーマットの選択と後処理をこのリクエストの値に差し替える (前回と同じなら作り直さない)
+
+        YoutubeDLはどちらも初期化時に組み立てるため、同じ手順で作り直す。
+        """
+        key = json.dumps([fmt, postprocessors], sort_keys=True, default=str)
+        if key == self._processing:
+            return
+        from yt_dlp.postprocessor import get_postprocessor
+        from yt_dlp.utils import POSTPROCESS_WHEN
+
+        ydl = self.ydl
+        if fmt is None:
+            ydl.params.pop('format', None)
+        else:
+            ydl.params['format'] = fmt
+        ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else ydl.build_format_selector(fmt)
+        ydl._pps = {when: [] for when in POSTPROCESS_WHEN}
+        for pp_def in postprocessors:
+            pp_def = dict(pp_def)
+            when = pp_def.pop('when', 'post_process')
+            # 生成時にこのインスタンスの進捗フックを登録済みなので、add_post_processor で二重に登録しない
+            ydl._pps[when].append(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def))
+        self._processing = key
+
+
+class YoutubeDLPool:
+    """YoutubeDLのインスタンスを再利用するプール (プロセス内の全セッションで共有)
+
+    抽出器の初期化・プレイヤーJS/署名のキャッシュ・HTTPのkeep-alive接続を次のリクエストへ引き継ぐ。
+    YoutubeDLはスレッドセーフではないため、1つのインスタンスは同時に1つのリクエストにだけ貸し出す。
+    yt-dlpのディスクキャッシュ (cachedir) は settings.YDL_CACHE_DIR に永続化する。
+    """
+
+    def __init__(self, max_idle=settings.YDL_POOL_MAX_IDLE, cachedir=settings.YDL_CACHE_DIR):
+        self.max_idle = max_idle
+        self.cachedir = cachedir
+        self._idle = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    @contextmanager
+    def acquire(self, opts):
+        """opts と同じ設定のYoutubeDLを貸し出す
+
+        outtmpl・進捗フック・フォーマットの選択・後処理はこのリクエストの値に差し替えるので、
+        出力形式や音質が違うリクエストも同じインスタンスを使い回せる。
+        """
+        params = {k: v for k, v in opts.items() if k not in _PER_REQUEST_KEYS}
+        params.setdefault('cachedir', self.cachedir)
+        key = json.dumps(params, sort_keys=True, default=str)
+
+        with self._lock:
+            idle = self._idle.get(key)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            entry = _PooledYoutubeDL(params)
+
+        from yt_dlp.utils import DEFAULT_OUTTMPL
+        entry.ydl.params['outtmpl'] = {**DEFAULT_OUTTMPL, 'default': opts.get('outtmpl', DEFAULT_OUTTMPL['default'])}
+        entry.hooks = list(opts.get('progress_hooks', ()))
+        entry.pp_hooks = list(opts.get('postprocessor_hooks', ()))
+        try:
+            entry.set_processing(opts.get('format'), opts.get('postprocessors', []))
+            yield entry.ydl
+        except BaseException:
+            # 失敗したインスタンスは状態が分からないので使い回さない
+            entry.ydl.close()
+            raise
+        entry.hooks = []
+        entry.pp_hooks = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(entry)
+                return
+        entry.ydl.close()
+
+    def close(self):
+        """待機中のインスタンスをすべて閉じる"""
+        with self._lock:
+            entries = [entry for idle in self._idle.values() for entry in idle]
+            self._idle = {}
+        for entry in entries:
+            try:
+                entry.ydl.close()
+            except OSError:
+                # 終了時にはクッキーファイルが先に削除されていることがある (書き戻しに失敗するだけ)
+                pass
+
+
+# プロセス全体で共有するプール
+default_pool = YoutubeDLPool()
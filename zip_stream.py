@@ -0,0 +1,64 @@
+import os
+import shutil
+import zipfile
+from contextlib import contextmanager
+
+# 書き込み時のコピー単位
+CHUNK_SIZE = 1024 * 1024
+
+
+class StreamingZipWriter:
+    """ディスク上のファイルへ逐次書き込むZIPライター
+
+    アーカイブ全体をメモリに載せず、エントリごとにチャンク単位で書き出す。
+    MP3はDEFLATEしてもほとんど縮まないため、既定は無圧縮 (store) モード。
+    """
+
+    def __init__(self, path, store_only=True):
+        self.path = path
+        self.compression = zipfile.ZIP_STORED if store_only else zipfile.ZIP_DEFLATED
+        self._zf = zipfile.ZipFile(path, 'w', self.compression, allowZip64=True)
+        self._names = set()
+
+    def _unique_name(self, arcname):
+        # ZIP内で同名ファイルが衝突しないよう連番を付与
+        base, ext = os.path.splitext(arcname)
+        candidate = arcname
+        n = 2
+        while candidate in self._names:
+            candidate = f"{base} ({n}){ext}"
+            n += 1
+        self._names.add(candidate)
+        return candidate
+
+    def add_file(self, src_path, arcname):
+        """ディスク上のファイルをエントリとして追加し、実際のエントリ名を返す"""
+        arcname = self._unique_name(arcname)
+        self._zf.write(src_path, arcname=arcname)
+        return arcname
+
+    @contextmanager
+    def open_entry(self, arcname):
+        """書き込み用にエントリを開き、(実際のエントリ名, 書き込み先) を返す"""
+        arcname = self._unique_name(arcname)
+        with self._zf.open(arcname, 'w', force_zip64=True) as dest:
+            yield arcname, dest
+
+    def add_stream(self, arcname, fileobj):
+        """ファイルライクオブジェクトの内容をエントリとして追加し、実際のエントリ名を返す"""
+        with self.open_entry(arcname) as (arcname, dest):
+            shutil.copyfileobj(fileobj, dest, CHUNK_SIZE)
+        return arcname
+
+    def close(self):
+        self._zf.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._zf.close()
+        if exc_type is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+